@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import DiceSet, Word, Puzzle, Play, Player, WordList
+from .models import DiceSet, Word, Puzzle, Play, Player, WordList, Standing, PuzzleJob
 
 # Register your models here.
 admin.site.register(DiceSet)
@@ -8,3 +8,5 @@ admin.site.register(Puzzle)
 admin.site.register(Play)
 admin.site.register(Player)
 admin.site.register(WordList)
+admin.site.register(Standing)
+admin.site.register(PuzzleJob)
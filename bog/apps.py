@@ -2,7 +2,21 @@
 from __future__ import unicode_literals
 
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+
+
+def sqlite(sender, connection, **kwargs):
+    """
+    Put SQLite databases in WAL mode, so that reading doesn't wait for writing and only writers
+    wait for each other.
+    """
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode=WAL')
 
 
 class BogConfig(AppConfig):
     name = 'bog'
+
+    def ready(self):
+        connection_created.connect(sqlite)
@@ -0,0 +1,126 @@
+"""
+Archiving completed plays' word lists.
+
+Every word a player finds, misses or repeats is a WordList record, and they're kept after the game
+is over, so that table grows as long as people play. Once a play is complete, its records never
+change, so "manage.py compactplays" packs them into the play's archive field (see
+bog.packed.packrecords), ids and foundtimes and all, and deletes them, a batch of plays at a time.
+
+Anything that reads a player's words gets them from here, rather than from play.wordlist_set, so
+that it doesn't matter whether they've been archived: records() and others() give WordList
+objects, archived ones unsaved but with the ids they had, and wordids() gives the ids of the
+words found. A play is read from both places, in case a word turned up after it was archived.
+"""
+import collections
+
+from django.db import transaction
+from django.db.models import Q
+
+from bog import models, packed, puzzles
+
+
+def _unpack(play, data):
+    return [models.WordList(pk=pk, play=play, word_id=word, foundtime=foundtime)
+            for pk, word, foundtime in packed.unpackrecords(data)]
+
+
+def _words(records):
+    """Fill in each record's word, with one query for them all."""
+    words = models.Word.objects.in_bulk([record.word_id for record in records
+                                         if record.word_id is not None])
+    for record in records:
+        if record.word_id is not None:
+            record.word = words[record.word_id]
+    return records
+
+
+def records(play):
+    """
+    Every WordList record of the play, archived or not, in order of id, with its word. Takes a
+    query for the records that are still in the table, and one for the words of archived ones.
+    """
+    archived = _unpack(play, play.archive)
+    if archived:
+        _words(archived)
+    return sorted(archived + list(play.wordlist_set.select_related('word')),
+                  key=lambda record: record.pk)
+
+
+def others(play, mine, since=None):
+    """
+    {Word id: [WordList record...]} for everybody else's finds on the play's puzzle, each with
+    play.player.user filled in, in order of id. With a since cursor (a WordList id), only the
+    finds after it, and every find of the words that the player has found after it, going by
+    their records, mine. Takes two queries.
+    """
+    found = models.WordList.objects\
+        .filter(play__puzzle=play.puzzle_id, play__player__isnull=False)\
+        .exclude(play__player=play.player_id)
+    plays = models.Play.objects\
+        .filter(puzzle=play.puzzle_id, player__isnull=False, archive__isnull=False)\
+        .exclude(player=play.player_id)
+    if since is not None:
+        new = {record.word_id for record in mine
+               if record.pk > since and record.word_id is not None}
+        found = found.filter(Q(pk__gt=since) | Q(word__in=new))
+    finds = list(found.select_related('play__player__user'))
+    for other in plays.select_related('player__user'):
+        finds.extend(record for record in _unpack(other, other.archive)
+                     if since is None or record.pk > since or record.word_id in new)
+    others = collections.defaultdict(list)
+    for record in sorted(finds, key=lambda record: record.pk):
+        others[record.word_id].append(record)
+    return others
+
+
+def wordids(play):
+    """
+    The ids of the words the play has found, archived or not, in one query. The play's archive
+    is read afresh, for plays that have been kept in memory (see bog.validwords).
+    """
+    rows = list(models.Play.objects.filter(pk=play.pk).values_list('archive', 'wordlist__word'))
+    found = {word for data, word in rows}
+    if rows and rows[0][0] is not None:
+        # The archive comes with each of the records still in the table, but it's the same one.
+        found.update(word for pk, word, foundtime in packed.unpackrecords(rows[0][0]))
+    found.discard(None)
+    return found
+
+
+def spellings(plays):
+    """{play id: [spelling, or None for a penalty, of each record...]} for the plays, archived
+    or not. For adding up their scores (see bog.scoring)."""
+    archived = {play: [word for pk, word, foundtime in packed.unpackrecords(data)]
+                for play, data in models.Play.objects.filter(pk__in=plays, archive__isnull=False)
+                .values_list('pk', 'archive')}
+    words = puzzles.spellings({word for found in archived.values() for word in found
+                               if word is not None})
+    found = collections.defaultdict(list)
+    for play, ids in archived.items():
+        found[play] = [words.get(word) for word in ids]
+    for play, spelling in models.WordList.objects.filter(play__in=plays)\
+            .values_list('play', 'word__word'):
+        found[play].append(spelling)
+    return found
+
+
+def compact(plays):
+    """
+    Archive the WordList records of the plays (by id), which should be complete, in one
+    transaction. Plays already archived have any records since added to their archive. Returns
+    how many records were archived.
+    """
+    with transaction.atomic():
+        found = collections.defaultdict(list)
+        pks = []
+        for pk, play, word, foundtime in models.WordList.objects.filter(play__in=plays)\
+                .values_list('pk', 'play', 'word', 'foundtime'):
+            found[play].append((pk, word, foundtime))
+            pks.append(pk)
+        for play, data in models.Play.objects.filter(pk__in=plays).values_list('pk', 'archive'):
+            records = packed.unpackrecords(data) + found[play]
+            models.Play.objects.filter(pk=play).update(archive=packed.packrecords(records))
+        # Only the records that were read, in case any more have just been added.
+        for start in range(0, len(pks), puzzles.CHUNK):
+            models.WordList.objects.filter(pk__in=pks[start:start+puzzles.CHUNK]).delete()
+    return len(pks)
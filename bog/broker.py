@@ -0,0 +1,164 @@
+"""
+Passing found words on to everybody else playing the same puzzle, as they happen.
+
+Every accepted word is published to its puzzle's channel, and the /wordlist/<pk>/stream/
+endpoint (see views.wordstream) passes them on to the player as server-sent events. This saves
+the players polling /wordlist/<pk>/ to see what everybody else has found.
+
+The broker is settings.BOG_BROKER. The default, LocalBroker, only reaches subscribers in the
+same process: words found by a player whose requests are served by another process never get
+there. That's fine for a server running a single process, but with several, use DatabaseBroker,
+which finds new words by polling the WordList table instead, every settings.BOG_BROKER_POLL
+seconds. Anything with the same subscribe() and publish() can take the place of either.
+"""
+import collections
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils.duration import duration_string
+from django.utils.module_loading import import_string
+
+from bog import models
+
+
+class Subscription:
+    """The events published to one puzzle, for one subscriber, in the order they were published."""
+    def __init__(self, broker, puzzle, size):
+        self.broker = broker
+        self.puzzle = puzzle
+        self.events = queue.Queue(size)
+
+    def get(self, timeout=None):
+        """The next event, or None if there isn't one within timeout seconds."""
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    """
+    Passes events to subscribers in this process only.
+
+    A subscriber that falls more than size events behind misses the ones after that. It can
+    catch up with /wordlist/<pk>/?since=<cursor>.
+    """
+    def __init__(self, size=100):
+        self.size = size
+        self.subscriptions = collections.defaultdict(set)
+        self.lock = threading.Lock()
+
+    def subscribe(self, puzzle):
+        subscription = Subscription(self, puzzle, self.size)
+        with self.lock:
+            self.subscriptions[puzzle].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.puzzle)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscriptions[subscription.puzzle]
+
+    def publish(self, puzzle, event):
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(puzzle, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.events.put_nowait(event)
+            except queue.Full:
+                pass
+
+
+class DatabaseSubscription:
+    """
+    The words found on one puzzle since the subscription started, read from the WordList table,
+    in order of id.
+    """
+    def __init__(self, puzzle, interval):
+        self.puzzle = puzzle
+        self.interval = interval
+        self.cursor = models.WordList.objects.aggregate(cursor=Max('pk'))['cursor'] or 0
+        self.events = collections.deque()
+
+    def poll(self):
+        found = models.WordList.objects\
+            .filter(play__puzzle=self.puzzle, play__player__isnull=False, word__isnull=False,
+                    pk__gt=self.cursor)\
+            .select_related('word', 'play__player__user').order_by('pk')
+        for wordlist in found:
+            self.events.append(event(wordlist, wordlist.word.word, wordlist.play.player.user))
+            self.cursor = wordlist.pk
+
+    def get(self, timeout=None):
+        """The next event, or None if there isn't one within timeout seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.events:
+            self.poll()
+            if self.events:
+                break
+            wait = self.interval
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    return None
+            time.sleep(wait)
+        return self.events.popleft()
+
+    def close(self):
+        pass
+
+
+class DatabaseBroker:
+    """
+    Finds the words found on each puzzle by polling the database, so it reaches subscribers in
+    every process. Publishing does nothing: the WordList record is the message.
+
+    Ids are handed out before the records are committed, so on a database that commits more than
+    one transaction at a time, a word can turn up after one with a later id, which has already
+    been passed on. It's missed, but /wordlist/<pk>/?since=<cursor> catches up with it.
+    """
+    def subscribe(self, puzzle):
+        return DatabaseSubscription(puzzle, settings.BOG_BROKER_POLL)
+
+    def publish(self, puzzle, event):
+        pass
+
+
+_broker = None
+_brokerlock = threading.Lock()
+
+
+def broker():
+    """The process-wide broker, settings.BOG_BROKER."""
+    global _broker
+    if _broker is None:
+        with _brokerlock:
+            if _broker is None:
+                _broker = import_string(settings.BOG_BROKER)()
+    return _broker
+
+
+def event(wordlist, spelling, user):
+    """The event for a word the user has found, given its WordList record."""
+    return {
+        'cursor': wordlist.pk,
+        'play': wordlist.play_id,
+        'word': spelling,
+        'player': user.get_full_name(),
+        'foundtime': duration_string(wordlist.foundtime),
+        'pk': wordlist.pk,
+    }
+
+
+def found(wordlist, spelling, user):
+    """Publish a word the user has just found, given its new WordList record."""
+    broker().publish(wordlist.play.puzzle_id, event(wordlist, spelling, user))
@@ -0,0 +1,25 @@
+"""
+Where worker processes pick up puzzle jobs (see bog.puzzles.start).
+
+Workers are spawned rather than forked, so that none of them shares the parent's database
+connections or threads, which means each has to set Django up for itself before anything imports
+the models. So this module imports no models, and is what the workers are given to run:
+bog.puzzles is only imported once setup() has run.
+"""
+import django
+from django.conf import settings
+
+
+def setup(databases):
+    """
+    Set Django up in a new worker, with the databases of the process that started it. Those aren't
+    always the ones in the settings file: under test, for one.
+    """
+    settings.DATABASES = databases
+    django.setup()
+
+
+def run(pk):
+    """Roll the puzzle for the PuzzleJob with the given id. See bog.puzzles.runjob."""
+    from bog import puzzles
+    puzzles.runjob(pk)
@@ -0,0 +1,130 @@
+"""
+Live rankings for each puzzle, without sorting every player's play on every request.
+
+Each puzzle's leaderboard is read from its Standing rows once, and kept in memory as a sorted
+list, so that the top players are a slice of it and anybody's rank is a binary search. As scores
+change in this process (see WordListSerializer.insert), the list is updated in place. Scores
+changed by other processes are picked up by reading the Standing rows again after
+settings.BOG_LEADERBOARD_TTL seconds. A player who starts playing in this process is added as
+soon as their Standing is created.
+
+The most recently used settings.BOG_LEADERBOARD_SIZE puzzles are kept.
+"""
+import bisect
+import collections
+import threading
+import time
+
+from django.conf import settings
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from bog import models
+
+
+class Leaderboard:
+    """
+    One puzzle's leaderboard.
+
+    order
+        (-score, play id) for every player, best first.
+
+    scores, names
+        {play id: score} and {play id: player name}.
+    """
+    def __init__(self, puzzle):
+        self.puzzle = puzzle
+        self.loaded = time.monotonic()
+        self.scores = {}
+        self.names = {}
+        for play, name, score in models.Standing.objects.filter(puzzle=puzzle)\
+                .values_list('play', 'player', 'score'):
+            self.scores[play] = score
+            self.names[play] = name
+        self.order = sorted((-score, play) for play, score in self.scores.items())
+        self._lock = threading.Lock()
+
+    def scored(self, play, change):
+        """The play's score has gone up (or down) by change."""
+        with self._lock:
+            score = self.scores.get(play)
+            if score is None:
+                return
+            del self.order[bisect.bisect_left(self.order, (-score, play))]
+            self.scores[play] = score + change
+            bisect.insort(self.order, (-score - change, play))
+
+    def joined(self, play, name, score):
+        """A new player's standing has been created."""
+        with self._lock:
+            if play in self.scores:
+                return
+            self.scores[play] = score
+            self.names[play] = name
+            bisect.insort(self.order, (-score, play))
+
+    def rank(self, play):
+        """Where the play is on the leaderboard, from 1. Ties share the better rank."""
+        score = self.scores.get(play)
+        if score is None:
+            return None
+        return bisect.bisect_left(self.order, (-score, )) + 1
+
+    def top(self, count):
+        """The first count players, as [(rank, name, score)...]."""
+        with self._lock:
+            order = self.order[:count]
+        top = []
+        for position, (score, play) in enumerate(order):
+            if top and top[-1][2] == -score:
+                rank = top[-1][0]
+            else:
+                rank = position + 1
+            top.append((rank, self.names[play], -score))
+        return top
+
+    def __len__(self):
+        return len(self.order)
+
+
+_puzzles = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+def get(puzzle):
+    """The leaderboard for the puzzle with the given id."""
+    with _lock:
+        board = _puzzles.get(puzzle)
+        if board is not None and time.monotonic() - board.loaded < settings.BOG_LEADERBOARD_TTL:
+            _puzzles.move_to_end(puzzle)
+            return board
+    board = Leaderboard(puzzle)
+    with _lock:
+        _puzzles[puzzle] = board
+        _puzzles.move_to_end(puzzle)
+        while len(_puzzles) > settings.BOG_LEADERBOARD_SIZE:
+            _puzzles.popitem(last=False)
+    return board
+
+
+def scored(puzzle, play, change):
+    """The play's score on the puzzle has changed. Update the leaderboard, if it's loaded."""
+    with _lock:
+        board = _puzzles.get(puzzle)
+    if board is not None:
+        board.scored(play, change)
+
+
+@receiver(post_save, sender=models.Standing)
+def _standingsaved(sender, instance, created, **kwargs):
+    if created:
+        with _lock:
+            board = _puzzles.get(instance.puzzle_id)
+        if board is not None:
+            board.joined(instance.play_id, instance.player, instance.score)
+
+
+def forget(puzzle):
+    """Drop the puzzle's leaderboard, so that it's read again next time."""
+    with _lock:
+        _puzzles.pop(puzzle, None)
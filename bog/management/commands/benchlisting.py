@@ -0,0 +1,89 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from bog import models
+from bog.views import ListCreatePuzzleView
+
+
+# Each made up puzzle's layout is its id, spelled in letters, which keeps them unique.
+LETTERS = str.maketrans("0123456789", "ABCDEFGHIJ")
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Shows how the open puzzle listing (ListCreatePuzzleView) holds up with lots of puzzles: the
+    query plans, and how long a page takes, at the start of the list and far down it. The old
+    listing, through the default play records, is shown alongside for comparison.
+
+    The puzzles are made up, added in a transaction, and rolled back afterwards, so this can be
+    run against a real database.
+    """
+    help = "Benchmark the open puzzle listing with a lot of puzzles"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--puzzles', type=int, default=1000000,
+                            help="How many puzzles to add.")
+        parser.add_argument('--open', type=float, default=0.05,
+                            help="The fraction of them that are still open.")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.fill(options['puzzles'], options['open'])
+                self.bench()
+                raise Rollback
+        except Rollback:
+            pass
+
+    def fill(self, count, fraction):
+        start = time.perf_counter()
+        last = models.Puzzle.objects.order_by('-pk').values_list('pk', flat=True).first()
+        first = (last or 0) + 1
+        now = timezone.now()
+        for chunk in range(first, first + count, 10000):
+            pks = range(chunk, min(chunk + 10000, first + count))
+            created = [now - timedelta(seconds=first + count - pk) for pk in pks]
+            opened = [random.random() < fraction for pk in pks]
+            models.Puzzle.objects.bulk_create([
+                models.Puzzle(pk=pk, layout=("%025d" % pk).translate(LETTERS),
+                              width=5, height=5, created=date, is_open=isopen)
+                for pk, date, isopen in zip(pks, created, opened)
+            ])
+            models.Play.objects.bulk_create([
+                models.Play(puzzle_id=pk, date=date, complete=not isopen)
+                for pk, date, isopen in zip(pks, created, opened)
+            ])
+        if connection.vendor == 'sqlite':
+            # So that the query planner knows what the tables look like now.
+            connection.cursor().execute("ANALYZE")
+        self.stdout.write("Added %d puzzles in %.1fs" % (count, time.perf_counter() - start))
+
+    def bench(self):
+        listing = ListCreatePuzzleView.queryset
+        size = ListCreatePuzzleView.pagination_class.page_size
+        openpuzzles = listing.count()
+        last = listing.values_list('created', 'pk')[openpuzzles * 9 // 10]
+        deep = listing.filter(created__lt=last[0])
+        old = models.Puzzle.objects\
+            .filter(pooled=False, options__complete=False, options__player__isnull=True)\
+            .order_by('-options__date')
+
+        for name, queryset in (("First page", listing),
+                               ("Page 90% of the way down", deep),
+                               ("The same page, by offset", listing[openpuzzles * 9 // 10:]),
+                               ("First page, the old way", old)):
+            page = queryset[:size + 1]
+            self.stdout.write("\n%s:" % name)
+            self.stdout.write(page.explain())
+            start = time.perf_counter()
+            for _ in range(10):
+                list(page.values_list('pk', flat=True))
+            self.stdout.write("%.2fms" % ((time.perf_counter() - start) * 100))
@@ -0,0 +1,147 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from bog import models, packed, puzzles
+
+
+# Each made up puzzle's layout is its id, spelled in letters, which keeps them unique.
+LETTERS = str.maketrans("0123456789", "ABCDEFGHIJ")
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Compares storing each puzzle's words packed into Puzzle.solution (see bog.packed) with the
+    old way, a WordList record on the puzzle's default play for each of them: how much space each
+    takes, and how long it takes to check a word, count the words, and load them all.
+
+    The puzzles and words are made up, added in a transaction, and rolled back afterwards, so this
+    can be run against a real database. The old records are made without their paths, which no
+    longer have a column, so the old way was somewhat bigger than shown.
+    """
+    help = "Benchmark packed puzzle solutions against a word list record for every word"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--puzzles', type=int, default=10000,
+                            help="How many puzzles to add.")
+        parser.add_argument('--words', type=int, default=200,
+                            help="How many words each puzzle has.")
+        parser.add_argument('--vocabulary', type=int, default=50000,
+                            help="How many different words there are.")
+        parser.add_argument('--lookups', type=int, default=1000,
+                            help="How many times to time each lookup.")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.fill(options)
+                self.bench(options['lookups'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def fill(self, options):
+        start = time.perf_counter()
+        first = (models.Word.objects.order_by('-pk').values_list('pk', flat=True).first() or 0) + 1
+        models.Word.objects.bulk_create([models.Word(pk=pk, word="bench%d" % pk) for pk in
+                                         range(first, first + options['vocabulary'])])
+        self.words = range(first, first + options['vocabulary'])
+
+        last = models.Puzzle.objects.order_by('-pk').values_list('pk', flat=True).first()
+        first = (last or 0) + 1
+        pks = range(first, first + options['puzzles'])
+        for chunk in range(0, len(pks), 1000):
+            models.Puzzle.objects.bulk_create([
+                models.Puzzle(pk=pk, layout=("%025d" % pk).translate(LETTERS), width=5, height=5)
+                for pk in pks[chunk:chunk + 1000]
+            ])
+            models.Play.objects.bulk_create([models.Play(puzzle_id=pk)
+                                             for pk in pks[chunk:chunk + 1000]])
+        self.puzzles = dict(models.Play.objects.filter(puzzle__in=pks, player=None)
+                            .values_list('puzzle', 'pk').iterator())
+
+        # Each puzzle's words, the old way and then packed, measuring the tables in between.
+        # Each puzzle's words are made up the same way both times, from its id.
+        def solution(pk):
+            rng = random.Random(pk)
+            return [(word, bytes(rng.sample(range(25), rng.randint(3, 8))))
+                    for word in rng.sample(self.words, options['words'])]
+
+        self.sizes = [self.size()]
+        for chunk in range(0, len(pks), 1000):
+            models.WordList.objects.bulk_create([
+                models.WordList(play_id=self.puzzles[pk], word_id=word)
+                for pk in pks[chunk:chunk + 1000] for word, path in solution(pk)
+            ])
+        self.sizes.append(self.size())
+        for pk in pks:
+            models.Puzzle.objects.filter(pk=pk).update(solution=packed.pack(solution(pk)))
+        self.sizes.append(self.size())
+
+        if connection.vendor == 'sqlite':
+            # So that the query planner knows what the tables look like now.
+            connection.cursor().execute("ANALYZE")
+        self.stdout.write("Added %d puzzles of %d words in %.1fs" % (
+            options['puzzles'], options['words'], time.perf_counter() - start))
+
+    def size(self):
+        """The bytes taken by the word list table and the puzzle table, indexes and all, if the
+        database can say."""
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                try:
+                    cursor.execute(
+                        "SELECT sqlite_master.tbl_name, SUM(dbstat.pgsize) FROM dbstat "
+                        "JOIN sqlite_master ON dbstat.name = sqlite_master.name "
+                        "WHERE sqlite_master.tbl_name IN (%s, %s) GROUP BY sqlite_master.tbl_name",
+                        [models.WordList._meta.db_table, models.Puzzle._meta.db_table])
+                except Exception:
+                    # SQLite wasn't built with the dbstat table.
+                    return None
+            elif connection.vendor == 'postgresql':
+                cursor.execute("SELECT %s, pg_total_relation_size(%s) UNION ALL "
+                               "SELECT %s, pg_total_relation_size(%s)",
+                               [models.WordList._meta.db_table] * 2
+                               + [models.Puzzle._meta.db_table] * 2)
+            else:
+                return None
+            sizes = dict(cursor.fetchall())
+        return (sizes.get(models.WordList._meta.db_table, 0),
+                sizes.get(models.Puzzle._meta.db_table, 0))
+
+    def bench(self, lookups):
+        if None not in self.sizes:
+            (wordlists, bare), (withwords, __), (__, withpacked) = self.sizes
+            self.stdout.write("\nSpace for the words: %.1fMB as word list records, %.1fMB packed"
+                              % ((withwords - wordlists) / 2**20,
+                                 (withpacked - bare) / 2**20))
+
+        puzzle = list(self.puzzles)
+        samples = [(random.choice(puzzle), random.choice(self.words)) for _ in range(lookups)]
+        for name, old, new in (
+                ("Is the word on the puzzle?",
+                 lambda pk, word: models.WordList.objects.filter(play=self.puzzles[pk],
+                                                                 word=word).exists(),
+                 lambda pk, word: packed.contains(self.solution(pk), word)),
+                ("How many words are there?",
+                 lambda pk, word: models.WordList.objects.filter(play=self.puzzles[pk]).count(),
+                 lambda pk, word: packed.count(self.solution(pk))),
+                ("All the words, and their ids",
+                 lambda pk, word: dict(models.WordList.objects.filter(play=self.puzzles[pk])
+                                       .values_list('word__word', 'word_id')),
+                 lambda pk, word: puzzles.spellings(packed.unpack(self.solution(pk)).ids))):
+            self.stdout.write("\n%s" % name)
+            for way, lookup in (("Word list records", old), ("Packed", new)):
+                start = time.perf_counter()
+                for pk, word in samples:
+                    lookup(pk, word)
+                self.stdout.write("  %s: %.3fms" % (
+                    way, (time.perf_counter() - start) * 1000 / len(samples)))
+
+    def solution(self, pk):
+        return models.Puzzle.objects.values_list('solution', flat=True).get(pk=pk)
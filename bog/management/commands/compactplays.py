@@ -0,0 +1,54 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from bog import archive, models
+
+
+class Command(BaseCommand):
+    """
+    Archives the word lists of completed plays: each play's WordList records are packed into the
+    play itself, and deleted. See bog.archive.
+
+    Plays are done --batch at a time, in order of id, each batch in a transaction of its own, so
+    that no lock is held for long, with a --pause between batches to leave the database free for
+    everybody playing. Only plays started at least --age days ago are archived, so that players
+    still looking over a game they've just finished aren't slowed down by it.
+    """
+    help = "Pack the word lists of completed plays into the plays, and delete them"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=100,
+                            help="Plays to archive in each transaction.")
+        parser.add_argument('--pause', type=float, default=0.5,
+                            help="Seconds to wait between batches.")
+        parser.add_argument('--age', type=float, default=7,
+                            help="Only archive plays started at least this many days ago.")
+
+    def handle(self, *args, **options):
+        if options['batch'] < 1:
+            raise CommandError("--batch must be at least 1")
+        plays = models.Play.objects.filter(
+            player__isnull=False, complete=True, archive__isnull=True,
+            date__lt=timezone.now() - timedelta(days=options['age']))
+
+        compacted = records = 0
+        last = 0
+        started = time.monotonic()
+        while True:
+            batch = list(plays.filter(pk__gt=last).order_by('pk')
+                         .values_list('pk', flat=True)[:options['batch']])
+            if not batch:
+                break
+            if compacted and options['pause']:
+                time.sleep(options['pause'])
+            records += archive.compact(batch)
+            compacted += len(batch)
+            last = batch[-1]
+            if options['verbosity'] > 1:
+                self.stdout.write("%d plays, %d records archived" % (compacted, records))
+
+        self.stdout.write(self.style.SUCCESS(
+            "Archived %d records from %d plays in %.1fs"
+            % (records, compacted, time.monotonic() - started)))
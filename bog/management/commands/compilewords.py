@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from bog.pyBogged import DICTIONARY, readdictionary, wordtrie
+
+
+class Command(BaseCommand):
+    """
+    Compiles the dictionary into the packed word index that every worker maps at startup.
+    Run this at deploy time, and again whenever the dictionary changes. Workers that are already
+    running keep using the old file until they're restarted.
+    """
+    help = "Compile the dictionary into the memory mapped word index (settings.BOG_WORDINDEX)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dictionary', default=DICTIONARY,
+                            help="Word list to compile, one word per line. May be gzipped.")
+        parser.add_argument('--output', default=settings.BOG_WORDINDEX,
+                            help="Where to write the compiled index.")
+
+    def handle(self, *args, **options):
+        trie = wordtrie(readdictionary(options['dictionary']))
+        trie.save(options['output'])
+        # Check that it loads back again before declaring success.
+        trie = wordtrie.load(options['output'])
+        self.stdout.write(self.style.SUCCESS(
+            "Compiled %d nodes from %s into %s (version %s)"
+            % (len(trie), options['dictionary'], options['output'], trie.version)))
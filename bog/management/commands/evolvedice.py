@@ -0,0 +1,173 @@
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import statistics
+
+from django.core.management.base import BaseCommand, CommandError
+from bog import models
+from bog.pyBogged import geometry, normalize, wordcounts, wordindex
+
+LETTERS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+class Command(BaseCommand):
+    """
+    Evolves dice sets with a genetic algorithm, looking for ones that put plenty of words on every
+    board rather than a lot on some and hardly any on others.
+
+    Each dice set's fitness is the average number of words on --samples boards rolled from it,
+    less --spread times their standard deviation. Dice sets are rolled and solved in a pool of
+    --processes worker processes, each of which loads the word index once, when it starts.
+
+    Each generation keeps the --elite fittest sets as they are, and breeds the rest from parents
+    picked by tournament: each die from one parent or the other, and then each face changed to a
+    random letter with probability --mutation. The first generation is bred the same way from the
+    dice sets given (or all of them, of the right size), or is random if there aren't any.
+
+    Once each generation has been measured, everything needed to carry on is written to
+    --checkpoint, and --resume carries on from there, with the settings it was started with. At
+    the end, the --save fittest sets are saved as DiceSets.
+    """
+    help = "Evolve dice sets that roll boards with plenty of words, and save the best ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument('diceset', nargs='*', type=int,
+                            help="Ids of the dice sets to start from. Default is all of the "
+                                 "right size.")
+        parser.add_argument('--width', type=int, default=4)
+        parser.add_argument('--height', type=int, default=4)
+        parser.add_argument('--population', type=int, default=40,
+                            help="Dice sets in each generation.")
+        parser.add_argument('--generations', type=int, default=50,
+                            help="Generations to run, counting any before a --resume.")
+        parser.add_argument('--samples', type=int, default=200,
+                            help="Boards to roll from each dice set to measure it.")
+        parser.add_argument('--spread', type=float, default=1.0,
+                            help="How much to penalize the standard deviation of the word count.")
+        parser.add_argument('--mutation', type=float, default=0.02,
+                            help="Chance of each face of a new dice set changing.")
+        parser.add_argument('--elite', type=int, default=2,
+                            help="Fittest dice sets carried over unchanged to the next generation.")
+        parser.add_argument('--tournament', type=int, default=3,
+                            help="Dice sets to pick each parent from.")
+        parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                            help="Worker processes. 0 measures the dice sets in this process.")
+        parser.add_argument('--checkpoint', default="evolvedice.json",
+                            help="Where to keep the state of the run between generations.")
+        parser.add_argument('--resume', action='store_true',
+                            help="Carry on from the checkpoint.")
+        parser.add_argument('--save', type=int, default=3,
+                            help="How many of the fittest dice sets to save at the end.")
+        parser.add_argument('--seed', type=int,
+                            help="Random seed for breeding, to make a run repeatable.")
+
+    def handle(self, *args, **options):
+        if options['resume']:
+            try:
+                with open(options['checkpoint']) as checkpoint:
+                    state = json.load(checkpoint)
+            except FileNotFoundError:
+                raise CommandError("No checkpoint at %s to resume from" % options['checkpoint'])
+            self.rng = random.Random()
+            self.rng.setstate((state['rng'][0], tuple(state['rng'][1]), state['rng'][2]))
+        else:
+            state = self.start(options)
+        self.settings = state['settings']
+        width, height = self.settings['width'], self.settings['height']
+        population = state['population']
+        scores = state['scores']
+
+        if options['processes']:
+            # Spawned, so that none of the workers shares this process's database connection.
+            pool = multiprocessing.get_context('spawn').Pool(options['processes'],
+                                                             initializer=wordindex)
+            starmap = pool.starmap
+        else:
+            pool = None
+            starmap = itertools.starmap
+        try:
+            while True:
+                # Sets carried over from the last generation have already been measured.
+                unmeasured = [dice for dice in population if dice not in scores]
+                for dice, counts in zip(unmeasured, starmap(wordcounts, [
+                        (dice, width, height, self.settings['samples']) for dice in unmeasured])):
+                    scores[dice] = [statistics.mean(counts), statistics.pstdev(counts)]
+                population.sort(key=lambda dice: self.fitness(scores[dice]), reverse=True)
+                best = scores[population[0]]
+                self.stdout.write("Generation %d: best %.1f words (sd %.1f), fitness %.1f"
+                                  % (state['generation'], best[0], best[1], self.fitness(best)))
+                state.update(population=population, scores=scores, rng=self.rng.getstate())
+                self.checkpoint(state, options['checkpoint'])
+
+                if state['generation'] >= options['generations']:
+                    break
+                population = self.breed(population, scores, options)
+                scores = {dice: scores[dice] for dice in population if dice in scores}
+                state['generation'] += 1
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        for dice in population[:options['save']]:
+            mean, stdev = scores[dice]
+            diceset, created = models.DiceSet.objects.get_or_create(dice=dice, defaults={
+                'description': "Evolved %dx%d, generation %d: %.1f words (sd %.1f)"
+                               % (width, height, state['generation'], mean, stdev),
+                'width': width,
+                'height': height,
+            })
+            self.stdout.write("%s dice set %d: %s" % ("Saved" if created else "Already have",
+                                                      diceset.pk, dice))
+
+    def start(self, options):
+        """The state of a new run, with the first generation bred from the dice sets given."""
+        self.rng = random.Random(options['seed'])
+        width, height = geometry("A" * options['width'] * options['height'] * 6,
+                                 options['width'], options['height'])
+        dicesets = models.DiceSet.objects.filter(width=width, height=height)
+        if options['diceset']:
+            dicesets = models.DiceSet.objects.filter(pk__in=options['diceset'])
+            if any((diceset.width, diceset.height) != (width, height) for diceset in dicesets):
+                raise CommandError("The dice sets given must all be %dx%d" % (width, height))
+        population = [normalize(dice) for dice in dicesets.values_list('dice', flat=True)]
+        if not population:
+            population = [normalize("".join(self.rng.choice(LETTERS)
+                                            for _ in range(width * height * 6)))]
+        while len(population) < options['population']:
+            population.append(self.mutate(self.rng.choice(population), 0.2))
+        return {
+            'settings': {key: options[key] for key in ('width', 'height', 'samples', 'spread')},
+            'generation': 0,
+            'population': population[:options['population']],
+            'scores': {},
+        }
+
+    def fitness(self, score):
+        mean, stdev = score
+        return mean - self.settings['spread'] * stdev
+
+    def breed(self, population, scores, options):
+        """The next generation, from this one sorted fittest first."""
+        def parent():
+            return min(self.rng.sample(range(len(population)),
+                                       min(options['tournament'], len(population))))
+        children = population[:options['elite']]
+        while len(children) < len(population):
+            mother, father = population[parent()], population[parent()]
+            dice = "".join(self.rng.choice((mother, father))[i:i+6]
+                           for i in range(0, len(mother), 6))
+            children.append(self.mutate(dice, options['mutation']))
+        return children
+
+    def mutate(self, dice, rate):
+        return normalize("".join(self.rng.choice(LETTERS) if self.rng.random() < rate else face
+                                 for face in dice))
+
+    def checkpoint(self, state, filename):
+        # Written beside it first, so an interrupted write doesn't lose the last checkpoint.
+        with open(filename + ".tmp", "w") as checkpoint:
+            json.dump(state, checkpoint)
+        os.replace(filename + ".tmp", filename)
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from bog import models, puzzles
+from bog.pyBogged import solutions
+
+
+class Command(BaseCommand):
+    """
+    Fills the pool of pre-rolled puzzles, so that the first players after a deploy don't have to
+    wait for boards to be solved. See bog.puzzles.
+    """
+    help = "Roll puzzles into the pool for each dice set (or just the ones given)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('diceset', nargs='*', type=int,
+                            help="Ids of the dice sets to fill. Default is all of them.")
+        parser.add_argument('--size', type=int, default=settings.BOG_POOL_SIZE,
+                            help="Puzzles to have ready for each dice set.")
+
+    def handle(self, *args, **options):
+        dicesets = models.DiceSet.objects.all()
+        if options['diceset']:
+            dicesets = dicesets.filter(pk__in=options['diceset'])
+        for diceset in dicesets:
+            added = puzzles.fill(diceset, options['size'])
+            self.stdout.write("%s: added %d puzzles" % (diceset.description, added))
+        if solutions() is not None:
+            self.stdout.write("Solution cache: %(hits)d hits, %(diskhits)d from disk, "
+                              "%(misses)d misses" % solutions().stats())
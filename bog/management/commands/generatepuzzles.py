@@ -0,0 +1,111 @@
+import functools
+import math
+import multiprocessing
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from bog import models, puzzles
+from bog.pyBogged import constraints, solvedgames, wordindex
+
+
+class Command(BaseCommand):
+    """
+    Generates lots of puzzles from a dice set at once, e.g. a season of daily puzzles.
+
+    Boards are rolled and solved --batch at a time in a pool of --workers worker processes, each of
+    which loads the word index once, when it starts. Meanwhile, the solved boards are written
+    --chunk at a time, with a handful of bulk inserts for each chunk (see bog.puzzles.store).
+
+    Layouts already used by other puzzles are read up front, and boards that roll one of them
+    again are skipped, so that the unique layout doesn't turn away a whole chunk. If a
+    round of rolling doesn't turn up any new boards, the dice set is taken to have run out of
+    them, and it stops short.
+    """
+    help = "Roll, solve and store many puzzles from a dice set in parallel"
+
+    def add_arguments(self, parser):
+        parser.add_argument('diceset', type=int, help="Id of the dice set to roll.")
+        parser.add_argument('--count', type=int, default=1000, help="Puzzles to create.")
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help="Worker processes. 0 solves the boards in this process.")
+        parser.add_argument('--batch', type=int, default=20,
+                            help="Boards for a worker to solve at a time.")
+        parser.add_argument('--chunk', type=int, default=puzzles.CHUNK,
+                            help="Puzzles to store at a time. At most %d." % puzzles.CHUNK)
+        parser.add_argument('--pooled', action='store_true',
+                            help="Put the puzzles in the pool, rather than listing them.")
+        parser.add_argument('--minwords', type=int, help="Fewest words on each board.")
+        parser.add_argument('--maxwords', type=int, help="Most words on each board.")
+        parser.add_argument('--longest', type=int,
+                            help="Length of a word that each board must have.")
+
+    def handle(self, *args, **options):
+        try:
+            diceset = models.DiceSet.objects.get(pk=options['diceset'])
+        except models.DiceSet.DoesNotExist:
+            raise CommandError("No dice set %d" % options['diceset'])
+        if not 0 < options['chunk'] <= puzzles.CHUNK:
+            raise CommandError("--chunk must be from 1 to %d" % puzzles.CHUNK)
+        limits = constraints(options['minwords'], options['maxwords'], options['longest'])
+
+        # Only layouts of the same size can be the same.
+        layouts = set(models.Puzzle.objects.filter(width=diceset.width, height=diceset.height)
+                      .values_list('layout', flat=True).iterator())
+
+        if options['workers']:
+            # Spawned, so that none of the workers shares this process's database connection.
+            pool = multiprocessing.get_context('spawn').Pool(options['workers'],
+                                                             initializer=wordindex)
+            imap = pool.imap_unordered
+        else:
+            pool = None
+            imap = map
+
+        count = options['count']
+        created = skipped = 0
+        chunk = []
+        started = time.monotonic()
+        try:
+            while created + len(chunk) < count:
+                wanted = count - created - len(chunk)
+                # Each task is one batch of boards, given the dice set's chromosome.
+                solve = functools.partial(solvedgames, width=diceset.width,
+                                          height=diceset.height, count=options['batch'],
+                                          constraints=limits)
+                new = 0
+                for games in imap(solve, [diceset.dice] * math.ceil(wanted / options['batch'])):
+                    for layout, words, paths in games:
+                        if created + len(chunk) >= count:
+                            # The last batch rolled more than was needed.
+                            break
+                        if layout in layouts:
+                            skipped += 1
+                            continue
+                        layouts.add(layout)
+                        chunk.append((layout, words, paths))
+                        new += 1
+                        if len(chunk) >= options['chunk']:
+                            created += puzzles.store(diceset, chunk, pooled=options['pooled'])
+                            chunk = []
+                            self.progress(created, count, skipped, started)
+                if not new:
+                    self.stdout.write("No new boards turned up. The dice set may have run out "
+                                      "of layouts, or hardly any of its boards fit.")
+                    break
+            if chunk:
+                created += puzzles.store(diceset, chunk, pooled=options['pooled'])
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            "Created %d puzzles in %.1fs (%.1f a second), skipping %d repeated layouts"
+            % (created, elapsed, created / elapsed if elapsed else 0, skipped)))
+
+    def progress(self, created, count, skipped, started):
+        elapsed = time.monotonic() - started
+        self.stdout.write("%d of %d puzzles, %.1f a second, %d repeated layouts skipped"
+                          % (created, count, created / elapsed if elapsed else 0, skipped))
@@ -0,0 +1,73 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, OuterRef, Q, Subquery
+from django.utils import timezone
+from bog import archive, models, scoring
+
+
+class Command(BaseCommand):
+    """
+    Adds up every play's score again from its word list (archived or not), and puts right the
+    ones that have drifted from what was kept up to date as words were found, along with their
+    leaderboard standings. See bog.scoring.
+
+    Plays are done a chunk at a time, in order of id, so this takes a few queries per chunk however
+    many plays there are. Games that may still be going on are left alone unless --all is given,
+    because their scores can change while they're being checked.
+    """
+    help = "Recompute play scores from their word lists, and fix any that are wrong"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk', type=int, default=500,
+                            help="Plays to recompute at a time.")
+        parser.add_argument('--check', action='store_true',
+                            help="Only report the scores that are wrong, don't fix them.")
+        parser.add_argument('--all', action='store_true',
+                            help="Include games that may still be in progress.")
+
+    def handle(self, *args, **options):
+        plays = models.Play.objects.filter(player__isnull=False)
+        if not options['all']:
+            plays = plays.filter(Q(complete=True) | Q(date__lt=timezone.now() - timedelta(days=1)))
+
+        checked = drifted = drift = 0
+        last = 0
+        while True:
+            chunk = list(plays.filter(pk__gt=last).order_by('pk')
+                         .values_list('pk', 'points', 'score', 'minimumwordlength', 'handicap')
+                         [:options['chunk']])
+            if not chunk:
+                break
+
+            # Archived plays' words are in the plays themselves. See bog.archive.
+            spellings = archive.spellings([play[0] for play in chunk])
+            last = chunk[-1][0]
+
+            wrong = []
+            for pk, points, score, minimumwordlength, handicap in chunk:
+                rightpoints, rightscore = scoring.score(spellings[pk], minimumwordlength, handicap)
+                if (rightpoints, rightscore) != (points, score):
+                    wrong.append((pk, rightpoints - points))
+                    drift += abs(rightscore - score)
+            checked += len(chunk)
+            drifted += len(wrong)
+
+            if wrong and not options['check']:
+                # Corrected by the difference, in case a word is found in the meantime anyway, and
+                # the scores worked out again from the points once the plays are locked.
+                with transaction.atomic():
+                    for pk, change in wrong:
+                        models.Play.objects.filter(pk=pk).update(points=F('points') + change)
+                    for pk, points, handicap in models.Play.objects\
+                            .filter(pk__in=[pk for pk, change in wrong])\
+                            .values_list('pk', 'points', 'handicap'):
+                        models.Play.objects.filter(pk=pk)\
+                            .update(score=scoring.handicapped(points, handicap))
+                    models.Standing.objects.filter(play__in=[pk for pk, change in wrong])\
+                        .update(score=Subquery(models.Play.objects.filter(pk=OuterRef('play'))
+                                               .values('score')))
+
+        self.stdout.write("%d plays checked, %d had drifted by %d points in all%s" % (
+            checked, drifted, drift, "" if options['check'] or not drifted else ", now fixed"))
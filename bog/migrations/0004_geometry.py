@@ -0,0 +1,56 @@
+# Generated by Django 2.1.2 on 2026-10-17 09:12
+
+from django.db import migrations, models
+
+
+def square(apps, schema_editor):
+    """Every dice set and puzzle up to now has been square, either 4x4 or 5x5."""
+    for model, field, sides in (('DiceSet', 'dice', 6), ('Puzzle', 'layout', 1)):
+        for obj in apps.get_model('bog', model).objects.all():
+            obj.width = obj.height = int(round((len(getattr(obj, field)) // sides) ** 0.5))
+            obj.save(update_fields=['width', 'height'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bog', '0003_auto_20181019_2344'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diceset',
+            name='width',
+            field=models.PositiveSmallIntegerField(blank=True, default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='diceset',
+            name='height',
+            field=models.PositiveSmallIntegerField(blank=True, default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='puzzle',
+            name='width',
+            field=models.PositiveSmallIntegerField(blank=True, default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='puzzle',
+            name='height',
+            field=models.PositiveSmallIntegerField(blank=True, default=0),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='diceset',
+            name='dice',
+            field=models.CharField(max_length=384, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='puzzle',
+            name='layout',
+            field=models.CharField(max_length=64, unique=True),
+        ),
+        migrations.RunPython(square, migrations.RunPython.noop),
+    ]
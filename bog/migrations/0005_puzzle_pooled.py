@@ -0,0 +1,18 @@
+# Generated by Django 2.1.2 on 2026-10-17 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bog', '0004_geometry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='puzzle',
+            name='pooled',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1.2 on 2026-10-17 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bog', '0005_puzzle_pooled'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wordlist',
+            name='path',
+            field=models.BinaryField(null=True),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 2.1.2 on 2026-10-17 12:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def standings(apps, schema_editor):
+    """Every player's play so far gets its place on the leaderboard."""
+    Play = apps.get_model('bog', 'Play')
+    Standing = apps.get_model('bog', 'Standing')
+    plays = Play.objects.filter(player__isnull=False)\
+        .values_list('pk', 'puzzle', 'score', 'player__user__first_name', 'player__user__last_name')
+    Standing.objects.bulk_create([
+        Standing(play_id=pk, puzzle_id=puzzle, score=score, player=" ".join(names).strip())
+        for pk, puzzle, score, *names in plays.iterator()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bog', '0006_wordlist_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Standing',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('player', models.CharField(max_length=150)),
+                ('score', models.IntegerField(default=0)),
+                ('play', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='bog.Play')),
+                ('puzzle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='bog.Puzzle')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='standing',
+            index=models.Index(fields=['puzzle', '-score'], name='bog_standin_puzzle__021b32_idx'),
+        ),
+        migrations.RunPython(standings, migrations.RunPython.noop),
+    ]
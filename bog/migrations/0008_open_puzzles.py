@@ -0,0 +1,45 @@
+# Generated by Django 2.1.2 on 2026-10-17 13:05
+
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef, Subquery
+import django.utils.timezone
+
+
+def copy(apps, schema_editor):
+    """Copy is_open and created from each puzzle's default play record, in one UPDATE."""
+    Puzzle = apps.get_model('bog', 'Puzzle')
+    plays = apps.get_model('bog', 'Play').objects.filter(player__isnull=True)
+    own = plays.filter(puzzle=OuterRef('pk'))
+    Puzzle.objects.filter(pk__in=plays.values('puzzle')).update(
+        is_open=~Exists(own.filter(complete=True)),
+        created=Subquery(own.values('date')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bog', '0007_standing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='puzzle',
+            name='created',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='puzzle',
+            name='is_open',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddIndex(
+            model_name='play',
+            index=models.Index(fields=['puzzle', 'player', 'complete', 'date'], name='bog_play_puzzle__569521_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='puzzle',
+            index=models.Index(fields=['pooled', 'is_open', '-created', '-id'], name='bog_puzzle_pooled_58019d_idx'),
+        ),
+        migrations.RunPython(copy, migrations.RunPython.noop),
+    ]
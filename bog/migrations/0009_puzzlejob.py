@@ -0,0 +1,29 @@
+# Generated by Django 2.1.2 on 2026-10-17 13:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('bog', '0008_open_puzzles'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PuzzleJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('options', models.TextField(default='{}')),
+                ('status', models.CharField(default='queued', max_length=10)),
+                ('error', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('createdby', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('diceset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='bog.DiceSet')),
+                ('puzzle', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='bog.Puzzle')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1.2 on 2026-10-17 15:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bog', '0009_puzzlejob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='puzzlejob',
+            name='constraints',
+            field=models.TextField(default='{}'),
+        ),
+    ]
@@ -0,0 +1,121 @@
+# Generated by Django 2.1.2 on 2026-10-17 16:20
+
+import collections
+
+from django.db import migrations, models
+
+# Puzzles to convert at a time.
+CHUNK = 500
+
+
+# The format as bog.packed had it when this was written, copied here so that later changes to it
+# don't change what this migration does.
+
+def _varint(number):
+    encoded = bytearray()
+    while number > 0x7f:
+        encoded.append(number & 0x7f | 0x80)
+        number >>= 7
+    encoded.append(number)
+    return encoded
+
+
+def _readvarint(data, offset):
+    """Returns the varint at offset, and the offset after it."""
+    number = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        number |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return number, offset
+        shift += 7
+
+
+def _pack(words):
+    """Pack [(word id, path or None)...] into bytes, for Puzzle.solution."""
+    words = sorted(words, key=lambda word: word[0])
+    packed = _varint(len(words))
+    last = 0
+    for word, path in words:
+        packed += _varint(word - last)
+        last = word
+    for word, path in words:
+        path = bytes(path or b"")
+        packed.append(len(path))
+        packed += path
+    return bytes(packed)
+
+
+def _unpack(data):
+    """[(word id, path or None)...] packed into data, in order of word id."""
+    data = bytes(data)
+    total, offset = _readvarint(data, 0)
+    ids = []
+    word = 0
+    for _ in range(total):
+        difference, offset = _readvarint(data, offset)
+        word += difference
+        ids.append(word)
+    words = []
+    for word in ids:
+        length = data[offset]
+        words.append((word, data[offset + 1:offset + 1 + length] or None))
+        offset += 1 + length
+    return words
+
+
+def pack(apps, schema_editor):
+    """Pack each puzzle's words from its default play's word list, and delete the word list."""
+    Puzzle = apps.get_model('bog', 'Puzzle')
+    Play = apps.get_model('bog', 'Play')
+    WordList = apps.get_model('bog', 'WordList')
+    last = 0
+    while True:
+        plays = list(Play.objects.filter(player__isnull=True, puzzle__gt=last).order_by('puzzle')
+                     .values_list('puzzle', 'pk')[:CHUNK])
+        if not plays:
+            break
+        words = collections.defaultdict(list)
+        for play, word, path in WordList.objects\
+                .filter(play__in=[play for puzzle, play in plays], word__isnull=False)\
+                .values_list('play', 'word', 'path'):
+            words[play].append((word, path))
+        for puzzle, play in plays:
+            Puzzle.objects.filter(pk=puzzle).update(solution=_pack(words[play]))
+        WordList.objects.filter(play__in=[play for puzzle, play in plays]).delete()
+        last = plays[-1][0]
+
+
+def unpack(apps, schema_editor):
+    """Put each puzzle's words back on its default play's word list."""
+    Puzzle = apps.get_model('bog', 'Puzzle')
+    Play = apps.get_model('bog', 'Play')
+    WordList = apps.get_model('bog', 'WordList')
+    plays = dict(Play.objects.filter(player__isnull=True).values_list('puzzle', 'pk'))
+    for puzzle, solution in Puzzle.objects.filter(solution__isnull=False)\
+            .values_list('pk', 'solution').iterator():
+        WordList.objects.bulk_create([
+            WordList(play_id=plays[puzzle], word_id=word, path=path)
+            for word, path in _unpack(solution)
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bog', '0010_puzzlejob_constraints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='puzzle',
+            name='solution',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.RunPython(pack, unpack),
+        migrations.RemoveField(
+            model_name='wordlist',
+            name='path',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1.2 on 2026-10-17 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bog', '0011_packed_solutions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='play',
+            name='archive',
+            field=models.BinaryField(null=True),
+        ),
+    ]
@@ -0,0 +1,108 @@
+# Generated by Django 2.1.2 on 2026-10-17 19:40
+
+import collections
+import math
+
+from django.db import migrations, models
+
+# Plays to recompute at a time.
+CHUNK = 500
+
+
+# Scoring and the archive format as bog.scoring and bog.packed had them when this was written,
+# copied here so that later changes to them don't change what this migration does.
+
+VALUES = (0, 1, 1, 1, 1, 2, 3, 5, 11)
+
+PENALTY = -1
+
+
+def _score(spellings, minimumwordlength, handicap):
+    """The points and the score of a play, given the words of all its WordList records."""
+    total = 0
+    for spelling in spellings:
+        if spelling is None:
+            total += PENALTY
+        elif len(spelling) >= minimumwordlength:
+            total += VALUES[min(len(spelling), len(VALUES) - 1)]
+    score = abs(total) * handicap
+    return total, int(math.copysign(math.floor(score + 0.5), total))
+
+
+def _readvarint(data, offset):
+    """Returns the varint at offset, and the offset after it."""
+    number = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        number |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return number, offset
+        shift += 7
+
+
+def _archivedwords(data):
+    """The Word id (or None) of each record packed into Play.archive, in order of record id."""
+    words = []
+    if not data:
+        return words
+    data = bytes(data)
+    total, offset = _readvarint(data, 0)
+    for _ in range(total):
+        # The record id, and the foundtime after the word, aren't needed.
+        difference, offset = _readvarint(data, offset)
+        word, offset = _readvarint(data, offset)
+        foundtime, offset = _readvarint(data, offset)
+        words.append(word - 1 if word else None)
+    return words
+
+
+def recompute(apps, schema_editor):
+    """
+    Work out each play's points from its word list (or its archive), and its score from them, now
+    that the handicap is applied to the total rather than to each word.
+    """
+    Play = apps.get_model('bog', 'Play')
+    WordList = apps.get_model('bog', 'WordList')
+    Word = apps.get_model('bog', 'Word')
+    Standing = apps.get_model('bog', 'Standing')
+    last = 0
+    while True:
+        plays = list(Play.objects.filter(player__isnull=False, pk__gt=last).order_by('pk')
+                     .values_list('pk', 'minimumwordlength', 'handicap', 'archive')[:CHUNK])
+        if not plays:
+            break
+        spellings = collections.defaultdict(list)
+        archived = {pk: _archivedwords(archive)
+                    for pk, minimumwordlength, handicap, archive in plays}
+        ids = list({word for found in archived.values() for word in found if word is not None})
+        words = {}
+        for start in range(0, len(ids), CHUNK):
+            words.update(Word.objects.filter(pk__in=ids[start:start+CHUNK])
+                         .values_list('pk', 'word'))
+        for pk, found in archived.items():
+            spellings[pk] = [words.get(word) for word in found]
+        for play, spelling in WordList.objects.filter(play__in=[play[0] for play in plays])\
+                .values_list('play', 'word__word'):
+            spellings[play].append(spelling)
+        for pk, minimumwordlength, handicap, archive in plays:
+            points, score = _score(spellings[pk], minimumwordlength, handicap)
+            Play.objects.filter(pk=pk).update(points=points, score=score)
+            Standing.objects.filter(play=pk).update(score=score)
+        last = plays[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bog', '0012_play_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='play',
+            name='points',
+            field=models.IntegerField(blank=True, default=0),
+        ),
+        migrations.RunPython(recompute, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 2.1.2 on 2026-10-17 21:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bog', '0013_play_points'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='puzzle',
+            name='layout',
+            field=models.CharField(max_length=64),
+        ),
+        migrations.AlterUniqueTogether(
+            name='puzzle',
+            unique_together={('layout', 'width', 'height')},
+        ),
+    ]
@@ -2,6 +2,12 @@ from django.db import models
 from django.contrib.auth.models import User
 from datetime import timedelta
 from django.core.exceptions import ValidationError
+from django.utils import timezone
+from . import packed
+from .pyBogged import geometry, normalize
+
+# The most dice a puzzle may have. 8x8, or any other shape with no more cells.
+MAXDICE = 64
 
 # This model consists of three main parts: users, games, and words.
 # games, users, and words are interrelated with a many/many/many relationship
@@ -24,8 +30,8 @@ from django.core.exceptions import ValidationError
 # prevents later changes to game rules changing the score, and also allows for user handicapping.
 
 
-# puzzle. Contains base set of game rules, game geometry (5x5 or 4x4, though others should be
-# supported if added.) Also contains creation time & user.
+# puzzle. Contains base set of game rules, game geometry (width x height, usually 5x5 or 4x4, but
+# 6x6 and rectangular boards work too.) Also contains creation time & user.
 
 # user. one-to-one with admin/users, and contains handicapping information etc.
 
@@ -48,36 +54,36 @@ class DiceSet(models.Model):
     Be aware that this would of course require modifications to the front end to allow players to
     enter words that would otherwise not be available, and to display 'Q' as 'Qu' etc.
 
-    The geometry is assumed to be square, and there are only two possibilities. 4x4 (length=16*6)
-    or 5x5 (length=25*6) Though in theory we can suppport odd (non-square) geometries and
-    non-six-sided dice, this is not currently supported.
+    The geometry is width x height, with one die for each cell. Non-six-sided dice are not
+    currently supported.
 
     description
         A brief description of this set of dice.
 
     dice
         String conforming to pybogged's expectations. Specifically, only uppercase letters,
-        and length must be exactly 96 or exactly 150 for 4x4 or 5x5 games respectively.
+        and length must be exactly width*height*6, e.g. 96 or 150 for 4x4 or 5x5 games.
+
+    width, height
+        The size of the grid these dice are rolled into. If left blank, the grid is assumed to
+        be square.
     """
     description = models.CharField(max_length=200)
-    dice = models.CharField(max_length=25*6, unique=True)
+    dice = models.CharField(max_length=MAXDICE*6, unique=True)
+    width = models.PositiveSmallIntegerField(blank=True)
+    height = models.PositiveSmallIntegerField(blank=True)
 
     def save(self, *args, **kwargs):
-        if len(self.dice) != 96 and len(self.dice) != 150:
-            raise ValidationError("Bad dice length detected:" + str(len(self.dice))
-                                  + ". Must be 16 or 25 six sided dice characters in "
-                                  "length (either 96 or 150 chars)")
+        self.width, self.height = geometry(self.dice, self.width, self.height)
+        if len(self.dice) > MAXDICE*6:
+            raise ValidationError("Too many dice: " + str(len(self.dice) // 6)
+                                  + ". At most " + str(MAXDICE) + " are allowed.")
 
         # Normalize the dice set. Do this by alphabatizing each die, then the set as dice.
         # Doing this insures that sets of dice that are the same (have the same results)
         # are in fact the same string. Note the comparisons here ARE case-sensitive. This isn't
         # important now, as everything is uppercase. But may be important in the future.
-        dicelist = [list(self.dice[i:i+6]) for i in range(0, len(self.dice), 6)]
-        for die in dicelist:
-            die.sort()
-        dicelist = ["".join(die) for die in dicelist]
-        dicelist.sort()
-        self.dice = "".join(dicelist)
+        self.dice = normalize(self.dice)
 
         # And finally save the model.
         models.Model.save(self, *args, **kwargs)
@@ -106,11 +112,28 @@ class Puzzle(models.Model):
         directly, or the dice set deleted afterwards.
 
     layout
-        Required to be length 16 or length 25, representing the 4x4 or 5x5 playing grid.
-        This field is all that is REALLY required to define a puzzle. All else is details.
+        One letter per cell, width*height long, e.g. length 16 or length 25, representing a 4x4
+        or 5x5 playing grid. This field (and its size) is all that is REALLY required to define
+        a puzzle. All else is details. It's unique among puzzles of the same size, as the same
+        letters make a different board in another shape (3x5 rather than 5x3, say).
+
+    width, height
+        The size of the grid. Copied from the dice set, as that may change or be deleted. If left
+        blank, the grid is assumed to be square.
+
+    pooled
+        True while the puzzle is sitting in the pool of pre-rolled puzzles, waiting to be handed
+        out. Pooled puzzles aren't listed or playable. See bog.puzzles.
+
+    is_open, created
+        Copies of not complete and date from the default play record (player=null), kept up to
+        date by Play.save(), so that open puzzles can be listed newest first from an index on
+        this table alone.
+
+    solution
+        Every word on the puzzle, and where it is, packed into one field. See bog.packed, and
+        solved().
     """
-    # moved to the "Play" record
-    # created = models.DateTimeField(auto_now_add=True)
 
     # This is to users, instead of players to allow easier creation of puzzles.
     createdby = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
@@ -119,10 +142,31 @@ class Puzzle(models.Model):
     # Everything we need to know about the puzzle is stored here.
     diceset = models.ForeignKey(DiceSet, on_delete=models.SET_NULL, null=True)
 
-    layout = models.CharField(max_length=25, unique=True)
+    layout = models.CharField(max_length=MAXDICE)
+    width = models.PositiveSmallIntegerField(blank=True)
+    height = models.PositiveSmallIntegerField(blank=True)
+    pooled = models.BooleanField(default=False, db_index=True)
+    is_open = models.BooleanField(default=True)
+    created = models.DateTimeField(default=timezone.now)
+    solution = models.BinaryField(null=True)
 
     # players = model.ManyToManyField(Player, through='Play')
 
+    def save(self, *args, **kwargs):
+        self.width, self.height = geometry(self.layout, self.width, self.height, sides=1)
+        return super().save(*args, **kwargs)
+
+    def solved(self):
+        """The words on the puzzle, as a bog.packed.Solution."""
+        return packed.unpack(self.solution)
+
+    class Meta:
+        unique_together = (("layout", "width", "height"), )
+        indexes = [
+            # The open puzzle listing: ListCreatePuzzleView.
+            models.Index(fields=['pooled', 'is_open', '-created', '-id']),
+        ]
+
 
 class Player(models.Model):
     """
@@ -159,17 +203,22 @@ class Play(models.Model):
     individual player handicapping may result in a players rules being different from the defaults
     for that puzzle.
 
-    When created with a null player when a puzzle is created, used to store the definitive word
-    list and the default (non-handicapped) game options.
+    When created with a null player when a puzzle is created, used to store the default
+    (non-handicapped) game options. The definitive word list is puzzle.solution.
 
     player
         null for initial puzzle wordlist and default game settings.
 
     words
-        lists all words this player found, or that are findable (if player==null)
+        lists all words this player found. None for player==null: see puzzle.solution. Once the
+        play is archived, these are in archive instead.
+
+    points
+        What the player's words are worth, before the handicap. Kept up to date as the player finds
+        words (see bog.scoring). 0 if player==null
 
     score
-        blank until the player completes the puzzle, or if player==null
+        points times the handicap, rounded. 0 if player==null
 
     date
         the date and time the puzzle was created/rolled and the words added.
@@ -201,41 +250,64 @@ class Play(models.Model):
         The difficulty rating for this puzzle. Players scores are multiplied by this. Also another
         way to handicap players that gives more flexibility.
 
+    archive
+        The play's WordList records, packed (see bog.archive), once it's complete and they've
+        been compacted. null until then.
+
     """
     player = models.ForeignKey(Player, on_delete=models.CASCADE, null=True)
     puzzle = models.ForeignKey(Puzzle, on_delete=models.CASCADE, related_name="options")
     words = models.ManyToManyField(Word, through='WordList')
     date = models.DateTimeField(auto_now_add=True)
 
-    # This field should be indexed, because we'll often search for
-    # "player=null&complete=False&orderby=-date"
+    # Indexed (see Meta), because we'll often search for
+    # "player=null&complete=False&orderby=-date". Puzzle.is_open and Puzzle.created are copies.
 
     complete = models.BooleanField(default=False)
     # Store score, options, Start time, duration, gave up, etc.
     score = models.IntegerField(default=0, blank=True)
+    points = models.IntegerField(default=0, blank=True)
     time = models.DurationField(default=timedelta(minutes=5), blank=True)
     missed = models.BooleanField(default=False)
     repeats = models.BooleanField(default=False)
     showmaximum = models.BooleanField(default=True)
     minimumwordlength = models.IntegerField(default=3)
     handicap = models.FloatField(default=1.0)
+    archive = models.BinaryField(null=True)
 
     def save(self, *args, **kwargs):
-        if self.player and not self.pk:
+        creating = self.player and not self.pk
+        # A new puzzle's defaults for is_open and created are right already.
+        puzzlechanged = self.player_id is None and self.pk is not None
+        if creating:
             # On creation of a new play method for a player, initialize from puzzles' play object.
             pplay = Play.objects.get(player=None, puzzle=self.puzzle)
-            self.score = 0
+            self.score = self.points = 0
             self.time = 0 if self.player.ignoreduration else pplay.time
             self.missed = pplay.missed
             self.repeats = pplay.repeats
             self.showmaximum = pplay.showmaximum
             self.minimumwordlength = pplay.minimumwordlength + self.player.minimumwordlength
-            self.handicap = pplay.handicap * self.player.handicap
-        return super().save(*args, **kwargs)
+            if self.player.handicap is not None:
+                self.handicap = pplay.handicap * self.player.handicap
+            else:
+                self.handicap = pplay.handicap
+        super().save(*args, **kwargs)
+        if puzzlechanged:
+            # The puzzle keeps copies of these, for listing open puzzles.
+            Puzzle.objects.filter(pk=self.puzzle_id)\
+                .update(is_open=not self.complete, created=self.date)
+        if creating:
+            # Every player gets a place on the puzzle's leaderboard.
+            Standing.objects.create(puzzle=self.puzzle, play=self,
+                                    player=self.player.user.get_full_name(), score=self.score)
 
     class Meta:
         unique_together = (("player", "puzzle"), )
         ordering = ('-date',)
+        indexes = [
+            models.Index(fields=['puzzle', 'player', 'complete', 'date']),
+        ]
 
 
 class WordList(models.Model):
@@ -249,15 +321,62 @@ class WordList(models.Model):
         If null, assume to be a record of a player misspelling a word.
 
     foundtime
-        If null, play.player must also be null. This is assumed to be the inital list of words
-        that's finable in this particular puzzle.
+        When the player found it, since the start of the game.
 
     """
     play = models.ForeignKey(Play, on_delete=models.CASCADE)
     word = models.ForeignKey(Word, on_delete=models.CASCADE, null=True)
 
-    # This is nullable only if player is null.
     foundtime = models.DurationField(null=True)
 
     class Meta:
         unique_together = (("play", "word"), )
+
+
+class Standing(models.Model):
+    """
+    A player's place on a puzzle's leaderboard (see bog.leaderboard): just their name and their
+    score, which is kept the same as play.score. This is the whole leaderboard for a puzzle in a
+    few small rows, without going through Play or User.
+
+    player
+        The player's name, as shown on the leaderboard.
+
+    """
+    puzzle = models.ForeignKey(Puzzle, on_delete=models.CASCADE)
+    play = models.OneToOneField(Play, on_delete=models.CASCADE)
+    player = models.CharField(max_length=150)
+    score = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=['puzzle', '-score'])]
+
+
+class PuzzleJob(models.Model):
+    """
+    A puzzle being rolled in the background, for somebody who asked for one when the pool was
+    empty. See bog.puzzles.
+
+    options
+        The game options for the puzzle's default play record, as JSON.
+
+    constraints
+        What the board has to have, as JSON keyword arguments for pyBogged.constraints.
+
+    status
+        One of QUEUED, RUNNING, DONE (puzzle is set) or FAILED (error says why).
+
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    diceset = models.ForeignKey(DiceSet, on_delete=models.CASCADE)
+    createdby = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    options = models.TextField(default='{}')
+    constraints = models.TextField(default='{}')
+    status = models.CharField(max_length=10, default=QUEUED)
+    puzzle = models.ForeignKey(Puzzle, on_delete=models.SET_NULL, null=True)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
@@ -0,0 +1,172 @@
+"""
+A puzzle's solution, packed into one field (Puzzle.solution), rather than a WordList record for
+every word on it.
+
+The words on a puzzle never change once it's rolled, but as WordList records on its default play
+they were most of that table, and most of its indexes. Packed, they're the Word ids in order, each
+stored as the difference from the one before as a varint (seven bits to a byte, lowest first, with
+the top bit set on every byte but the last), so that most take a byte or two. The count of words
+comes first, the same way. Then come the paths, in the same order: a byte for the length, then
+the cells, as pyBogged.board.find gives them. A length of 0 means the path isn't known, for
+puzzles stored before paths were, and the word has to be looked for on the board.
+
+A completed play's WordList records can be packed the same way, into Play.archive (see
+bog.archive): the count, then each record in order of id, as the difference from the id before,
+its Word id plus one (0 for a missed or repeated word, which has none), and its foundtime in
+microseconds, zigzagged so that it can't be negative, plus one (0 for none).
+"""
+import bisect
+from datetime import timedelta
+
+
+def _varint(number):
+    encoded = bytearray()
+    while number > 0x7f:
+        encoded.append(number & 0x7f | 0x80)
+        number >>= 7
+    encoded.append(number)
+    return encoded
+
+
+def _readvarint(data, offset):
+    """Returns the varint at offset, and the offset after it."""
+    number = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        number |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return number, offset
+        shift += 7
+
+
+def pack(words):
+    """Pack [(word id, path or None)...] into bytes, for Puzzle.solution."""
+    words = sorted(words, key=lambda word: word[0])
+    packed = _varint(len(words))
+    last = 0
+    for word, path in words:
+        packed += _varint(word - last)
+        last = word
+    for word, path in words:
+        path = bytes(path or b"")
+        packed.append(len(path))
+        packed += path
+    return bytes(packed)
+
+
+def count(data):
+    """How many words are in a packed solution, without unpacking the rest of it."""
+    if not data:
+        return 0
+    return _readvarint(bytes(data), 0)[0]
+
+
+def contains(data, word):
+    """Whether the Word id is in a packed solution, reading only as far as it would be."""
+    if not data:
+        return False
+    data = bytes(data)
+    total, offset = _readvarint(data, 0)
+    current = 0
+    for _ in range(total):
+        difference, offset = _readvarint(data, offset)
+        current += difference
+        if current >= word:
+            return current == word
+    return False
+
+
+class Solution:
+    """
+    A puzzle's words, unpacked from Puzzle.solution.
+
+    ids
+        The Word ids, in order.
+
+    paths
+        The path of each of them, in the same order, or None if it isn't known.
+    """
+    def __init__(self, data=None):
+        self.ids = []
+        self.paths = []
+        if not data:
+            return
+        data = bytes(data)
+        total, offset = _readvarint(data, 0)
+        word = 0
+        for _ in range(total):
+            difference, offset = _readvarint(data, offset)
+            word += difference
+            self.ids.append(word)
+        for _ in range(total):
+            length = data[offset]
+            self.paths.append(data[offset + 1:offset + 1 + length] or None)
+            offset += 1 + length
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __contains__(self, word):
+        return self.index(word) is not None
+
+    def index(self, word):
+        """Where the Word id is in ids, or None if it isn't on the puzzle."""
+        index = bisect.bisect_left(self.ids, word)
+        if index < len(self.ids) and self.ids[index] == word:
+            return index
+        return None
+
+    def path(self, word):
+        """The path of the word with this id, or None if it isn't on the puzzle or isn't known."""
+        index = self.index(word)
+        return None if index is None else self.paths[index]
+
+
+def unpack(data):
+    """The Solution packed into data (which may be None, for no words)."""
+    return Solution(data)
+
+
+def packrecords(records):
+    """Pack [(WordList id, Word id or None, foundtime or None)...] into bytes, for Play.archive."""
+    records = sorted(records, key=lambda record: record[0])
+    packed = _varint(len(records))
+    last = 0
+    for pk, word, foundtime in records:
+        packed += _varint(pk - last)
+        last = pk
+        packed += _varint(0 if word is None else word + 1)
+        if foundtime is None:
+            packed += _varint(0)
+        else:
+            microseconds = foundtime // timedelta(microseconds=1)
+            packed += _varint((microseconds * 2 if microseconds >= 0 else -microseconds * 2 - 1)
+                              + 1)
+    return bytes(packed)
+
+
+def unpackrecords(data):
+    """[(WordList id, Word id or None, foundtime or None)...] packed into data, in order of id."""
+    records = []
+    if not data:
+        return records
+    data = bytes(data)
+    total, offset = _readvarint(data, 0)
+    pk = 0
+    for _ in range(total):
+        difference, offset = _readvarint(data, offset)
+        pk += difference
+        word, offset = _readvarint(data, offset)
+        foundtime, offset = _readvarint(data, offset)
+        if foundtime:
+            foundtime -= 1
+            foundtime = timedelta(microseconds=-(foundtime + 1) // 2 if foundtime & 1
+                                  else foundtime // 2)
+        else:
+            foundtime = None
+        records.append((pk, word - 1 if word else None, foundtime))
+    return records
@@ -0,0 +1,352 @@
+"""
+Creating puzzles: rolling the dice, finding all the words, and storing the lot.
+
+Solving a board takes a while, so rather than make players wait for it, a pool of puzzles is
+rolled ahead of time for each dice set. A pooled puzzle is a complete puzzle, with its default
+play record and its word list, that is just hidden (Puzzle.pooled) until somebody asks for a new
+puzzle from that dice set. Claiming one then only has to fill in the game options.
+
+The pool is topped up to settings.BOG_POOL_SIZE by a background thread whenever it drops below
+settings.BOG_POOL_LOW_WATER, and can be filled up front with "manage.py fillpool".
+
+When the pool is empty, start() doesn't make the player wait for a puzzle to be rolled either. It
+records a PuzzleJob, and rolls the puzzle in one of settings.BOG_PUZZLE_WORKERS worker processes
+(see bog.jobs), so the request can be answered straight away with the job to poll. create()
+still rolls it on the spot, for admin tooling and for anything else that would rather wait.
+"""
+import atexit
+import concurrent.futures
+import copy
+import functools
+import json
+import logging
+import multiprocessing
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from bog import jobs, models, packed
+from .pyBogged import bogged, constraints as Constraints, solutions
+
+logger = logging.getLogger(__name__)
+
+# Most words to look up in one "IN" query. SQLite allows at most 999 parameters in a query.
+CHUNK = 500
+
+
+def wordids(spellings):
+    """
+    Returns {spelling: Word id} for the given words, creating the ones that don't exist yet. This
+    takes a few queries, however many words there are (up to CHUNK of them).
+    """
+    ids = {}
+    for start in range(0, len(spellings), CHUNK):
+        ids.update(models.Word.objects.filter(word__in=spellings[start:start+CHUNK])
+                   .values_list('word', 'id'))
+    missing = [spelling for spelling in spellings if spelling not in ids]
+    if missing:
+        try:
+            with transaction.atomic():
+                models.Word.objects.bulk_create([models.Word(word=spelling)
+                                                 for spelling in missing])
+        except IntegrityError:
+            # Somebody else added some of the same words at the same time.
+            pass
+        # Not every database says what ids bulk_create gave the new rows, so look them up.
+        for start in range(0, len(missing), CHUNK):
+            ids.update(models.Word.objects.filter(word__in=missing[start:start+CHUNK])
+                       .values_list('word', 'id'))
+        for spelling in missing:
+            if spelling not in ids:
+                ids[spelling] = models.Word.objects.get_or_create(word=spelling)[0].pk
+    return ids
+
+
+def spellings(ids):
+    """
+    Returns {Word id: spelling} for the given Word ids. This takes a query for every CHUNK of
+    them.
+    """
+    ids = list(ids)
+    words = {}
+    for start in range(0, len(ids), CHUNK):
+        words.update(models.Word.objects.filter(pk__in=ids[start:start+CHUNK])
+                     .values_list('id', 'word'))
+    return words
+
+
+def roll(diceset, createdby=None, options=None, pooled=False, constraints=None):
+    """
+    Roll the dice set, solve the board (unless it's in the solution cache), and create the
+    puzzle, its default play record (with the given options) and its word list. Returns the new
+    puzzle.
+
+    With constraints (a pyBogged.constraints), the dice are rolled until the board fits them, as
+    many as settings.BOG_GENERATE_ATTEMPTS times, for up to settings.BOG_GENERATE_TIMEOUT seconds.
+    Raises ValidationError if none of them fit.
+    """
+    bog = bogged(diceset.dice, diceset.width, diceset.height, cache=solutions())
+    bog.newgame(constraints, settings.BOG_GENERATE_ATTEMPTS, settings.BOG_GENERATE_TIMEOUT,
+                settings.BOG_GENERATE_BATCH)
+
+    # All at once, so this is a handful of queries rather than two or three for every word.
+    with transaction.atomic():
+        # The words, along with where each word is, all in the puzzle's solution.
+        ids = wordids(bog.words)
+        puzzle = models.Puzzle.objects.create(
+            diceset=diceset,
+            createdby=createdby,
+            layout=bog.layout,
+            width=bog.width,
+            height=bog.height,
+            pooled=pooled,
+            solution=packed.pack((ids[word], bog.paths[word]) for word in bog.words),
+        )
+        play = models.Play(puzzle=puzzle, **(options or {}))
+        play.save()
+
+    return puzzle
+
+
+def store(diceset, games, createdby=None, options=None, pooled=False):
+    """
+    Create puzzles from the dice set for already solved games, [(layout, words, paths)...] as
+    pyBogged.solvedgames returns them, along with their default play records (with the given
+    options). This is roll() in bulk, and takes a handful of queries for the lot, so up to CHUNK
+    games can be stored at a time.
+
+    Layouts that are already taken (by puzzles of the same size) are left out. Returns the number
+    of puzzles created.
+    """
+    games = {layout: (words, paths) for layout, words, paths in games}
+    while True:
+        taken = set(models.Puzzle.objects.filter(layout__in=list(games), width=diceset.width,
+                                                 height=diceset.height)
+                    .values_list('layout', flat=True))
+        games = {layout: game for layout, game in games.items() if layout not in taken}
+        if not games:
+            return 0
+        try:
+            with transaction.atomic():
+                return _store(diceset, games, createdby, options, pooled)
+        except IntegrityError:
+            # Somebody else took one of the layouts at the same time.
+            continue
+
+
+def _store(diceset, games, createdby, options, pooled):
+    ids = wordids(sorted({word for words, paths in games.values() for word in words}))
+    # Bulk creation skips Puzzle.save, so the size is filled in here.
+    models.Puzzle.objects.bulk_create([
+        models.Puzzle(diceset=diceset, createdby=createdby, layout=layout, width=diceset.width,
+                      height=diceset.height, pooled=pooled,
+                      solution=packed.pack((ids[word], paths[word]) for word in words))
+        for layout, (words, paths) in games.items()
+    ])
+    # Not every database says what ids bulk_create gave the new rows, so look them up.
+    puzzleids = models.Puzzle.objects.filter(layout__in=list(games), width=diceset.width,
+                                             height=diceset.height).values_list('pk', flat=True)
+    # Play.save only does anything more for players' play records, so it can be skipped too.
+    models.Play.objects.bulk_create([models.Play(puzzle_id=pk, **(options or {}))
+                                     for pk in puzzleids])
+    return len(games)
+
+
+def claim(diceset, createdby, options=None, constraints=None):
+    """
+    Take a puzzle for this dice set out of the pool, and give it the creator and game options.
+    With constraints, only a puzzle that fits them will do. Returns None if there isn't one.
+    """
+    pool = models.Puzzle.objects.filter(diceset=diceset, pooled=True).order_by('pk')
+    if constraints:
+        # The pool is small, so the puzzles that fit are picked out here.
+        fits = []
+        for pk, solution in pool.values_list('pk', 'solution'):
+            words = spellings(packed.unpack(solution).ids).values()
+            if constraints.fits(list(words)):
+                fits.append(pk)
+                if len(fits) == 5:
+                    break
+        pool = pool.filter(pk__in=fits)
+    for pk in pool.values_list('pk', flat=True)[:5]:
+        # Somebody else may claim the same puzzle at the same time. Whoever's update actually
+        # changes the row gets it.
+        with transaction.atomic():
+            if not models.Puzzle.objects.filter(pk=pk, pooled=True)\
+                    .update(pooled=False, createdby=createdby):
+                continue
+            play = models.Play.objects.get(puzzle=pk, player=None)
+            for field, value in (options or {}).items():
+                setattr(play, field, value)
+            # The puzzle is new as far as anyone can tell.
+            play.date = timezone.now()
+            play.save()
+        return models.Puzzle.objects.get(pk=pk)
+    return None
+
+
+def fill(diceset, size=None):
+    """
+    Roll puzzles for the dice set until there are size of them in the pool (by default,
+    settings.BOG_POOL_SIZE). Returns how many were added.
+    """
+    if size is None:
+        size = settings.BOG_POOL_SIZE
+    added = 0
+    while models.Puzzle.objects.filter(diceset=diceset, pooled=True).count() < size:
+        roll(diceset, pooled=True)
+        added += 1
+    return added
+
+
+# Dice sets with a refill thread running in this process, so that only one is started for each.
+_refilling = set()
+_refillinglock = threading.Lock()
+
+
+def refill(diceset):
+    """
+    Start filling the pool for the dice set in a background thread, if it's below
+    settings.BOG_POOL_LOW_WATER and isn't already being filled.
+    """
+    if models.Puzzle.objects.filter(diceset=diceset, pooled=True).count() \
+            >= settings.BOG_POOL_LOW_WATER:
+        return
+    with _refillinglock:
+        if diceset.pk in _refilling:
+            return
+        _refilling.add(diceset.pk)
+
+    def run():
+        try:
+            fill(diceset)
+        finally:
+            with _refillinglock:
+                _refilling.discard(diceset.pk)
+            # This thread had a database connection of its own.
+            connection.close()
+
+    threading.Thread(target=run, name="refill-%d" % diceset.pk, daemon=True).start()
+
+
+def create(diceset, createdby, options=None, constraints=None):
+    """
+    Returns a new puzzle for the dice set (that fits the constraints, if any are given), from the
+    pool if there's one ready, or rolled on the spot if not. Either way, the pool is topped up
+    afterwards if it's getting low.
+    """
+    puzzle = claim(diceset, createdby, options, constraints)
+    if puzzle is None:
+        puzzle = roll(diceset, createdby, options, constraints=constraints)
+    if settings.BOG_POOL_SIZE:
+        refill(diceset)
+    return puzzle
+
+
+def start(diceset, createdby, options=None, constraints=None):
+    """
+    Returns a new puzzle for the dice set (that fits the constraints, if any are given) if there's
+    one ready in the pool. If not, returns a PuzzleJob that the puzzle is being rolled for in a
+    worker process (or has been, if settings.BOG_PUZZLE_WORKERS is 0). Either way, the pool is
+    topped up afterwards if it's getting low.
+    """
+    result = claim(diceset, createdby, options, constraints)
+    if result is None:
+        result = models.PuzzleJob.objects.create(
+            diceset=diceset,
+            createdby=createdby,
+            options=json.dumps(options or {}, cls=DjangoJSONEncoder),
+            constraints=json.dumps(vars(constraints) if constraints else {}),
+        )
+        if settings.BOG_PUZZLE_WORKERS:
+            pool = executor()
+            future = pool.submit(jobs.run, result.pk)
+            future.add_done_callback(functools.partial(_jobdone, pool, result.pk))
+        else:
+            runjob(result.pk)
+            result.refresh_from_db()
+    if settings.BOG_POOL_SIZE:
+        refill(diceset)
+    return result
+
+
+def runjob(pk):
+    """Roll the puzzle for the PuzzleJob with the given id, and record how it went."""
+    job = models.PuzzleJob.objects.select_related('diceset', 'createdby').get(pk=pk)
+    models.PuzzleJob.objects.filter(pk=pk).update(status=models.PuzzleJob.RUNNING)
+    # The options went through JSON, so dates and durations are strings again.
+    options = {field: models.Play._meta.get_field(field).to_python(value)
+               for field, value in json.loads(job.options).items()}
+    try:
+        puzzle = roll(job.diceset, job.createdby, options,
+                      constraints=Constraints(**json.loads(job.constraints)))
+    except ValidationError as e:
+        # The dice didn't roll a board that fits in time.
+        models.PuzzleJob.objects.filter(pk=pk).update(status=models.PuzzleJob.FAILED,
+                                                      error=" ".join(e.messages))
+    except Exception as e:
+        logger.exception("Rolling a puzzle for job %d", pk)
+        models.PuzzleJob.objects.filter(pk=pk).update(status=models.PuzzleJob.FAILED,
+                                                      error=str(e) or type(e).__name__)
+    else:
+        models.PuzzleJob.objects.filter(pk=pk).update(status=models.PuzzleJob.DONE,
+                                                      puzzle=puzzle)
+
+
+def _jobdone(pool, pk, future):
+    """
+    Called in this process when a worker is done with a job. runjob() records how it went itself,
+    unless the worker couldn't run it at all (it died, or couldn't start), so then it's recorded
+    here, rather than leaving the job queued forever.
+    """
+    error = future.exception()
+    if error is None:
+        return
+    global _executor
+    try:
+        logger.error("Running puzzle job %d", pk, exc_info=error)
+        models.PuzzleJob.objects.filter(pk=pk).exclude(status=models.PuzzleJob.DONE)\
+            .update(status=models.PuzzleJob.FAILED, error=str(error) or type(error).__name__)
+        if isinstance(error, concurrent.futures.process.BrokenProcessPool):
+            # A broken pool won't run anything else, so start a new one for the next job.
+            with _executorlock:
+                if _executor is pool:
+                    _executor = None
+    finally:
+        # This is one of the executor's threads, with a database connection of its own.
+        connection.close()
+
+
+_executor = None
+_executorlock = threading.Lock()
+
+
+def newexecutor(workers, databases):
+    """A pool of worker processes that run puzzle jobs (see bog.jobs) against the databases."""
+    executor = concurrent.futures.ProcessPoolExecutor(
+        workers,
+        # Spawned, so that none of them shares this process's database connections or threads.
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=jobs.setup,
+        initargs=(copy.deepcopy(databases),),
+    )
+    # Finish the jobs already asked for on the way out.
+    atexit.register(executor.shutdown)
+    return executor
+
+
+def executor():
+    """
+    The process-wide pool of settings.BOG_PUZZLE_WORKERS processes that run puzzle jobs. It's only
+    started the first time a job needs it.
+    """
+    global _executor
+    if _executor is None:
+        with _executorlock:
+            if _executor is None:
+                _executor = newexecutor(settings.BOG_PUZZLE_WORKERS, settings.DATABASES)
+    return _executor
@@ -0,0 +1,89 @@
+"""
+Scoring words, the usual boggle way: the longer the word, the more it's worth.
+
+A play's score is kept up to date as words are found (see WordListSerializer), by adding the
+points for each WordList record as it's inserted. "manage.py recomputescores" adds them all up
+again from scratch, to check that nothing has been missed.
+
+Each record is worth:
+
+  * Its word's value from VALUES, if it's at least play.minimumwordlength letters long, and
+    nothing if it's shorter.
+  * A point off if it has no word. Those are only recorded for misspelled words when play.missed
+    is set, and for repeated words when play.repeats is set, so either way it's a penalty.
+
+Those points are added up in play.points, and play.score is that total times play.handicap,
+rounded to the nearest whole point (halves away from zero). The handicap is applied to the total
+rather than to each word, so that it scales the score as a whole: at a handicap of 0.5, two
+1-point words are worth a point between them, not nothing each.
+"""
+import math
+
+from django.db.models import F
+
+from bog import models
+
+# Points for a word of each length. Anything longer than the last is worth the same as it.
+VALUES = (0, 1, 1, 1, 1, 2, 3, 5, 11)
+
+PENALTY = -1
+
+
+def value(spelling, minimumwordlength):
+    """What the word is worth, before the handicap."""
+    if len(spelling) < minimumwordlength:
+        return 0
+    return VALUES[min(len(spelling), len(VALUES) - 1)]
+
+
+def points(spelling, minimumwordlength):
+    """
+    What a WordList record with this word (or None, for a penalty) adds to play.points for a play
+    with this minimumwordlength.
+    """
+    if spelling is None:
+        return PENALTY
+    return value(spelling, minimumwordlength)
+
+
+def handicapped(points, handicap):
+    """The score for a play's points, with its handicap."""
+    score = abs(points) * handicap
+    return int(math.copysign(math.floor(score + 0.5), points))
+
+
+def score(spellings, minimumwordlength, handicap):
+    """
+    The points and the score of a play with these rules, given the words of all its WordList
+    records.
+    """
+    total = sum(points(spelling, minimumwordlength) for spelling in spellings)
+    return total, handicapped(total, handicap)
+
+
+def add(play, change):
+    """
+    Add points to the play, in the database, and bring its score and its standing on the
+    leaderboard up to date. Returns how much the score changed by. Call it in the same transaction
+    as the WordList records the points are for.
+
+    With no handicap, that's an update of each. Otherwise the points are read back to work the
+    score out, after the update that locks the play's row until the transaction is over, so that
+    it's right however many words are being added to it at once.
+    """
+    if not change:
+        return 0
+    plays = models.Play.objects.filter(pk=play.pk)
+    standings = models.Standing.objects.filter(play=play.pk)
+    if play.handicap == 1:
+        plays.update(points=F('points') + change, score=F('score') + change)
+        standings.update(score=F('score') + change)
+        return change
+    plays.update(points=F('points') + change)
+    total = plays.values_list('points', flat=True).get()
+    score = handicapped(total, play.handicap)
+    change = score - handicapped(total - change, play.handicap)
+    if change:
+        plays.update(score=score)
+        standings.update(score=score)
+    return change
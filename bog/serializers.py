@@ -1,9 +1,20 @@
 from rest_framework import serializers
 from rest_framework.serializers import ALL_FIELDS
+from rest_framework.reverse import reverse
 from bog import models
-from .pyBogged import bogged
-from django.core.exceptions import PermissionDenied
-from django.db import IntegrityError
+from . import archive, broker, leaderboard, packed, puzzles, pyBogged, scoring, validwords, \
+    writebehind
+from django.conf import settings
+from django.core.exceptions import PermissionDenied, ValidationError as DjangoValidationError
+from django.db import IntegrityError, transaction
+
+
+def _puzzlewords(puzzle):
+    """The puzzle's words, from the cache if possible. See bog.validwords."""
+    puzzlewords = validwords.get(puzzle)
+    if puzzlewords is None:
+        raise serializers.ValidationError("Object with puzzle={} does not exist.".format(puzzle))
+    return puzzlewords
 
 
 class WordListSerializer(serializers.ModelSerializer):
@@ -17,12 +28,10 @@ class WordListSerializer(serializers.ModelSerializer):
         allow_blank=False,
         trim_whitespace=True,
     )
-    puzzle = serializers.SlugRelatedField(
-        write_only=True,
-        slug_field='puzzle',
-        queryset=models.Play.objects.filter(player=None),
-        allow_null=False,
-    )
+    puzzle = serializers.IntegerField(write_only=True)
+
+    def validate_puzzle(self, value):
+        return _puzzlewords(value)
 
     def create(self, validated_data):
         """
@@ -33,82 +42,208 @@ class WordListSerializer(serializers.ModelSerializer):
         Basically, we go through and try to do everything. If there's an error, it will
         mostly be a DoesNotExist, and mostly we want to throw that back for the frontend to
         deal with.
+
+        Both the puzzle's words and this user's play record are normally cached, so a valid
+        word costs its insert and the score updates, and nothing else.
         """
         errormessage = ""
 
-        # puzzleplay is the universal play object, with player=None
-        puzzleplay = validated_data['puzzle']
+        puzzlewords = validated_data['puzzle']
 
         # play is THIS USER'S play object. We'll need this to check what rules this user is
         # playing by.
         try:
-            try:
-                play = models.Play.objects.filter(puzzle=puzzleplay.puzzle,
-                                                  player=self.context['request'].user.player)[0]
-            except AttributeError:
-                raise PermissionDenied
-        except IndexError:
-            # There is no play record for this user/puzzle combination. Create it.
-            play = models.Play(puzzle=puzzleplay.puzzle, player=self.context['request'].user.player)
-            play.save()
+            play = puzzlewords.playfor(self.context['request'].user)
+        except AttributeError:
+            raise PermissionDenied
 
-        try:
-            # Here, we get the correct word record for this word. But note the roundabout method
-            # This is to make sure that it exists FOR THIS PUZZLE. Simply finding it isn't enough.
-            word = models.WordList.objects.filter(
-                play=puzzleplay,
-                word__word=validated_data['word']
-            )[0].word
-        except IndexError:
+        # The word has to exist FOR THIS PUZZLE. Simply being a word isn't enough.
+        word = puzzlewords.words.get(validated_data['word'])
+        if word is None:
             errormessage = "invalid word. Not on this puzzle or not a word."
-            if play.missed:
-                # Track missed words by adding a wordlist record with no word.
-                word = None
-            else:
+            if not play.missed:
                 raise IntegrityError(errormessage)
+            # Track missed words by adding a wordlist record with no word.
+
+        if settings.BOG_WRITEBEHIND:
+            return self.writebehind(play, word, validated_data)
 
         # Create the wordlist object.
-        wordlist = models.WordList(word=word, play=play, foundtime=validated_data['foundtime'])
+        wordlist = models.WordList(word_id=word, play=play, foundtime=validated_data['foundtime'])
 
         try:
-            wordlist.save()
+            if word is not None and play.complete and word in archive.wordids(play):
+                # Found before the play was archived, so the unique index can't tell.
+                raise IntegrityError
+            self.insert(play, [(wordlist, validated_data['word'] if word is not None else None)],
+                        self.context['request'].user)
         except IntegrityError:
             errormessage = "Not Unique. Word alread found."
             # The user entered the same word again.
             if play.repeats:
                 # Track repeated words by adding a wordlist record with no word.
-                wordlist.word = None
+                wordlist.word_id = None
                 # This "save" call should never get a uniqueness check failed, because null!=null
                 # (according to SQL)
-                wordlist.save()
+                self.insert(play, [(wordlist, None)], self.context['request'].user)
             else:
                 raise IntegrityError(errormessage)
 
         # Lie about it: If word=null, raise an integrityError
-        if(wordlist.word is None):
+        if(wordlist.word_id is None):
             raise IntegrityError(errormessage)
 
         return wordlist
 
+    def writebehind(self, play, word, validated_data):
+        """
+        Like create(), but with the answer worked out from memory, and the wordlist record queued
+        to be written later. See bog.writebehind.
+        """
+        errormessage = "invalid word. Not on this puzzle or not a word."
+        if word is not None and not validated_data['puzzle'].claim(play, word):
+            errormessage = "Not Unique. Word alread found."
+            if not play.repeats:
+                raise IntegrityError(errormessage)
+            # Track repeated words by adding a wordlist record with no word.
+            word = None
+
+        wordlist = models.WordList(word_id=word, play=play, foundtime=validated_data['foundtime'])
+        change = scoring.points(validated_data['word'] if word is not None else None,
+                                play.minimumwordlength)
+        writebehind.writer().submit(wordlist, validated_data['word'], change,
+                                    self.context['request'].user,
+                                    settings.BOG_WRITEBEHIND_DURABLE)
+
+        if word is None:
+            raise IntegrityError(errormessage)
+        return wordlist
+
+    @staticmethod
+    def insert(play, found, user):
+        """
+        Save the play's new wordlist records, given as [(record, spelling, or None for a
+        penalty)...], and add what they're worth to its score (and its standing on the
+        leaderboard) along with them. The score is updated in the database, so that it's right
+        whatever else is updating it at the same time. Raises IntegrityError, with nothing saved,
+        if any of the words had been found already.
+
+        Then let everybody else playing the puzzle know about the words. See bog.broker.
+        """
+        change = sum(scoring.points(spelling, play.minimumwordlength)
+                     for wordlist, spelling in found)
+        with transaction.atomic():
+            if len(found) == 1:
+                found[0][0].save()
+            else:
+                models.WordList.objects.bulk_create([wordlist for wordlist, spelling in found])
+            change = scoring.add(play, change)
+        if change:
+            leaderboard.scored(play.puzzle_id, play.pk, change)
+
+        words = {wordlist.word_id: (wordlist, spelling) for wordlist, spelling in found
+                 if spelling is not None}
+        # Not every database says what ids bulk_create gave the new rows, so look them up.
+        missing = [word for word, (wordlist, spelling) in words.items() if wordlist.pk is None]
+        if missing:
+            for pk, word in play.wordlist_set.filter(word__in=missing).values_list('pk', 'word'):
+                words[word][0].pk = pk
+        for wordlist, spelling in words.values():
+            broker.found(wordlist, spelling, user)
+
     class Meta:
         fields = ['puzzle', 'word', 'foundtime']
         model = models.WordList
 
 
-class DiceSetSerializer(serializers.ModelSerializer):
-    class Meta:
-        # fields = ('id', 'description', 'dice')
-        fields = ALL_FIELDS
-        model = models.DiceSet
+class FoundWordSerializer(serializers.Serializer):
+    word = serializers.CharField(
+        max_length=25,
+        min_length=2,
+        allow_blank=False,
+        trim_whitespace=True,
+    )
+    foundtime = serializers.DurationField()
 
 
-class OtherOptionsSerializer(serializers.ModelSerializer):
+class WordBatchSerializer(serializers.Serializer):
     """
-    Used exclusively for de-serializing the options in puzzle creation
+    A whole list of words found on one puzzle, for clients that have been saving them up while
+    they couldn't get through. They're checked in order, just as if they'd been added one at a
+    time with WordListSerializer, but stored all at once, with WordListSerializer.insert, or
+    queued for the write-behind writer (see bog.writebehind) together.
+
+    Saving returns what became of each word: "accepted", "missed" (not on the puzzle) or
+    "repeat" (already found). Missed and repeated words are recorded, and count against the
+    player, if play.missed and play.repeats say so.
     """
+    puzzle = serializers.IntegerField()
+    words = serializers.ListField(child=FoundWordSerializer(), max_length=500)
+
+    def validate_puzzle(self, value):
+        return _puzzlewords(value)
+
+    def create(self, validated_data):
+        puzzlewords = validated_data['puzzle']
+        user = self.context['request'].user
+        try:
+            play = puzzlewords.playfor(user)
+        except AttributeError:
+            raise PermissionDenied
+
+        known = None if settings.BOG_WRITEBEHIND else archive.wordids(play)
+        results = []
+        found = []
+        for item in validated_data['words']:
+            word = puzzlewords.words.get(item['word'])
+            if word is None:
+                result, record = "missed", play.missed
+            elif not self.claim(puzzlewords, play, word, known):
+                result, record = "repeat", play.repeats
+            else:
+                result, record = "accepted", True
+            results.append({'word': item['word'], 'result': result})
+            if record:
+                # Missed and repeated words are recorded with no word, as penalties.
+                accepted = result == "accepted"
+                found.append((models.WordList(word_id=word if accepted else None, play=play,
+                                              foundtime=item['foundtime']),
+                              item['word'] if accepted else None, results[-1]))
+
+        if settings.BOG_WRITEBEHIND:
+            written = writebehind.writer().submitall(
+                [(wordlist, spelling, scoring.points(spelling, play.minimumwordlength))
+                 for wordlist, spelling, result in found],
+                user, settings.BOG_WRITEBEHIND_DURABLE)
+            for queued, (wordlist, spelling, result) in zip(written, found):
+                if queued.error is not None:
+                    # Found by another process in the meantime.
+                    result['result'] = "repeat"
+        elif found:
+            WordListSerializer.insert(play, [(wordlist, spelling)
+                                             for wordlist, spelling, result in found], user)
+        return results
+
+    @staticmethod
+    def claim(puzzlewords, play, word, known):
+        """
+        Record that the play has found the word (by id), and return True, unless it had found it
+        already. With write-behind, that's in memory, just as for words added one at a time (see
+        bog.validwords). Otherwise it's in known, the words the play has in the database.
+        """
+        if known is None:
+            return puzzlewords.claim(play, word)
+        if word in known:
+            return False
+        known.add(word)
+        return True
+
+
+class DiceSetSerializer(serializers.ModelSerializer):
     class Meta:
-        exclude = ('player', 'id', )
-        model = models.Play
+        # fields = ('id', 'description', 'dice')
+        fields = ALL_FIELDS
+        model = models.DiceSet
 
 
 class OptionsSerializer(serializers.ModelSerializer):
@@ -119,7 +254,8 @@ class OptionsSerializer(serializers.ModelSerializer):
 
 class OptionsListSerializer(serializers.ListSerializer):
     def to_representation(self, data):
-        data = data.filter(player__isnull=True)
+        # Filtered here rather than in the database, so that prefetched options are used.
+        data = [play for play in data.all() if play.player_id is None]
         return super().to_representation(data)
 
 
@@ -131,47 +267,67 @@ class PuzzleSerializer(serializers.ModelSerializer):
         read_only=True,
         slug_field='description')
     createdby = serializers.SerializerMethodField()
+    wordcount = serializers.SerializerMethodField()
+    # What the board has to have. The dice are rolled until it does. See pyBogged.constraints.
+    minwords = serializers.IntegerField(write_only=True, required=False, min_value=0)
+    maxwords = serializers.IntegerField(write_only=True, required=False, min_value=0)
+    longest = serializers.IntegerField(write_only=True, required=False, min_value=1)
 
     def get_createdby(self, obj):
+        # Puzzles generated in bulk (see "manage.py generatepuzzles") have nobody to credit.
+        if obj.createdby is None:
+            return None
         return obj.createdby.get_full_name()
 
-    def create(self, validated_data):
+    def get_wordcount(self, obj):
+        return packed.count(obj.solution)
 
-        # remove options from _writeable_fields after creating the new play instance.
-        if 'options' in validated_data:
-            options = validated_data['options']
-            del validated_data['options']
-        else:
-            options = {}
+    def validate(self, data):
+        if data.get('maxwords', float('inf')) < data.get('minwords', 0):
+            raise serializers.ValidationError("maxwords must be at least minwords.")
+        return data
 
-        # Have to create the bog instance to get the randomized layout.
-        # raise ValueError(validated_data)
-        bog = bogged(validated_data['diceset'].dice)
-        bog.newgame()
-        validated_data['layout'] = bog.layout
+    def constraints(self):
+        """The validated constraints, as a pyBogged.constraints."""
+        return pyBogged.constraints(**{field: self.validated_data.get(field)
+                                       for field in ('minwords', 'maxwords', 'longest')})
 
-        # Get and set the creation user.
-        validated_data['createdby'] = self.context['request'].user
+    def create(self, validated_data):
+        """
+        The layout is whatever the dice say, so it's ignored here. The puzzle comes ready rolled
+        from the pool if possible, with its play record and word list. See bog.puzzles.
+        """
+        options = validated_data.get('options') or [{}]
 
-        # Create the puzzle record
-        puzzle = super().create(validated_data)
+        try:
+            return puzzles.create(validated_data['diceset'], self.context['request'].user,
+                                  options[0], self.constraints())
+        except DjangoValidationError as e:
+            # The dice didn't roll a board that fits in time.
+            raise serializers.ValidationError(e.messages)
 
-        options[0]['puzzle'] = puzzle
+    class Meta:
+        exclude = ['pooled', 'solution']
+        model = models.Puzzle
+        # The layout (and so its size) comes from the dice, not from what's posted, so there's
+        # nothing here to check against the unique layouts.
+        validators = []
 
-        # Create the play record
-        playserializer = OtherOptionsSerializer()
-        play = playserializer.create(options[0])
 
-        # Create the play.words records.
-        for word in bog.words:
-            word, created = models.Word.objects.get_or_create(word=word)
-            models.WordList.objects.create(word=word, play=play)
+class PuzzleJobSerializer(serializers.ModelSerializer):
+    """
+    A puzzle being rolled in the background. Poll "url" until the status is "done", when "puzzle"
+    is the new puzzle, or "failed".
+    """
+    url = serializers.SerializerMethodField()
+    puzzle = PuzzleSerializer(read_only=True)
 
-        return puzzle
+    def get_url(self, obj):
+        return reverse('puzzlejob', args=(obj.pk,), request=self.context.get('request'))
 
     class Meta:
-        exclude = []
-        model = models.Puzzle
+        fields = ('id', 'url', 'status', 'puzzle', 'error', 'created')
+        model = models.PuzzleJob
 
 
 class PlayerSerializer(serializers.ModelSerializer):
@@ -201,11 +357,9 @@ class PlayWordSerializer(serializers.ModelSerializer):
         allow_null=True)
 
     def get_players(self, obj):
+        # Everybody else's finds come from PlayWordListSerializer, all in one query.
         return serializers.ListSerializer(child=PuzzleWordSerializer()).to_representation(
-            models.WordList.objects.filter(word=obj.word,
-                                           play__puzzle=obj.play.puzzle,
-                                           play__player__isnull=False)
-                                   .exclude(play__player=obj.play.player)
+            self.context['others'].get(obj.word_id, [])
         )
 
     class Meta:
@@ -216,9 +370,19 @@ class PlayWordSerializer(serializers.ModelSerializer):
 class OrderedListSerializer(serializers.ListSerializer):
     """
     Subclass to insure that wordlist items are listed alphabetically by word__word.
+
+    If there's a "since" cursor in the context, only the words found after it, or that somebody
+    else has found since, are listed.
     """
     def to_representation(self, data):
-        return super().to_representation(data.order_by('word__word'))
+        # The play's records, archived or not, from PlayWordListSerializer. See bog.archive.
+        data = self.context['records']
+        if self.context.get('since') is not None:
+            others = self.context['others']
+            data = [record for record in data
+                    if record.pk > self.context['since'] or record.word_id in others]
+        data = sorted(data, key=lambda record: "" if record.word_id is None else record.word.word)
+        return super().to_representation(data)
 
 
 class PlayWordListSerializer(serializers.ModelSerializer):
@@ -228,9 +392,22 @@ class PlayWordListSerializer(serializers.ModelSerializer):
     for new found words to be added. "duration/word" in the one case, and "play" in the other.
 
     Note that we don't give a hoot about the other fields, only the words.
+
+    With a "since" cursor (a WordList id) in the context, only what has changed since is
+    included: the player's new words, with everybody's finds of them, and the player's older
+    words with just the finds since.
     """
     wordlist_set = OrderedListSerializer(child=PlayWordSerializer())
 
+    def to_representation(self, instance):
+        # The player's own words, and the words everybody else has found on this puzzle, by
+        # word id, for PlayWordSerializer.get_players, archived or not (see bog.archive). These
+        # take the same few queries, however many words and players there are.
+        self.context['records'] = archive.records(instance)
+        self.context['others'] = archive.others(instance, self.context['records'],
+                                                self.context.get('since'))
+        return super().to_representation(instance)
+
     class Meta:
         fields = ('wordlist_set', 'pk')
         model = models.Play
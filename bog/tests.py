@@ -1,6 +1,1407 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from django.test import TestCase
+import gzip
+import importlib
+import io
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from bog import archive, broker, jobs, leaderboard, models, packed, puzzles, pyBogged, scoring, \
+    validwords, writebehind
+
+# Fifteen E's and an S, so that every roll finds the same words, wherever the S lands.
+DICE = "EEEEEE" * 15 + "SSSSSS"
+WORDS = ["ees", "eee", "eeee", "eses", "see", "seee", "sees"]
+# A player's minimumwordlength is added to the puzzle's, so the tests' players have none, to
+# keep these three-letter words.
+
+
+def spellings(puzzle):
+    """The words in the puzzle's packed solution, in order."""
+    return sorted(models.Word.objects.filter(pk__in=list(puzzle.solved()))
+                  .values_list('word', flat=True))
+
+
+class WordsMixin:
+    """Solves boards against WORDS, rather than the whole dictionary."""
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(pyBogged, '_wordtrie', pyBogged.wordtrie(WORDS))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+@override_settings(BOG_POOL_SIZE=0, BOG_SOLUTIONCACHE_SIZE=0)
+class RollTests(WordsMixin, TestCase):
+    """Creating a puzzle's word list takes a fixed number of queries, however many words."""
+
+    def setUp(self):
+        super().setUp()
+        self.diceset = models.DiceSet.objects.create(description="test", dice=DICE)
+
+    def test_new_words(self):
+        # Word lookup, Word insert, Word id lookup, puzzle and play, and the savepoints around
+        # the whole thing and the Word insert.
+        with self.assertNumQueries(9):
+            puzzle = puzzles.roll(self.diceset)
+        self.assertEqual(spellings(puzzle), ["eee", "eeee", "ees", "see", "seee"])
+        self.assertEqual(models.Word.objects.count(), 5)
+
+    def test_existing_words(self):
+        for word in WORDS:
+            models.Word.objects.create(word=word)
+        with self.assertNumQueries(5):
+            puzzle = puzzles.roll(self.diceset)
+        self.assertEqual(len(puzzle.solved()), 5)
+        self.assertFalse(models.WordList.objects.exists())
+        self.assertEqual(models.Word.objects.count(), len(WORDS))
+
+    def test_paths(self):
+        puzzle = puzzles.roll(self.diceset)
+        solution = puzzle.solved()
+        for word in models.Word.objects.filter(pk__in=list(solution)):
+            spelled = "".join(puzzle.layout[cell] for cell in solution.path(word.pk))
+            self.assertEqual(spelled, word.word.upper())
+
+
+class PackedTests(TestCase):
+    """A puzzle's words and paths pack into a few bytes each, and unpack the same."""
+
+    def test_round_trip(self):
+        words = [(300, b"\x01\x02\x03"), (5, None), (70000, b"\x00\x04\x05\x06"), (6, b"\x07")]
+        data = packed.pack(words)
+        self.assertEqual(packed.count(data), 4)
+        solution = packed.unpack(data)
+        self.assertEqual(solution.ids, [5, 6, 300, 70000])
+        self.assertEqual(solution.path(300), b"\x01\x02\x03")
+        self.assertIsNone(solution.path(5))
+        self.assertIsNone(solution.path(7))
+        self.assertNotIn(7, solution)
+        self.assertIn(70000, solution)
+        self.assertEqual([word for word in (4, 5, 7, 300, 70000, 70001)
+                          if packed.contains(data, word)], [5, 300, 70000])
+        self.assertFalse(packed.contains(None, 5))
+        # The count, four ids (the last in three bytes), and the paths with their lengths.
+        self.assertEqual(len(data), 1 + 1 + 1 + 2 + 3 + 4 + 8)
+        self.assertEqual(len(packed.unpack(None)), 0)
+
+    def test_records(self):
+        records = [(12, None, timedelta(microseconds=-3)), (3, None, None),
+                   (10, 5, timedelta(seconds=10)), (11, 70000, timedelta(minutes=5))]
+        data = packed.packrecords(records)
+        self.assertEqual(packed.unpackrecords(data), sorted(records))
+        self.assertEqual(packed.count(data), 4)
+        self.assertEqual(packed.unpackrecords(None), [])
+
+    def test_migrations(self):
+        # The data migrations have copies of their own, which agree with these as they are now.
+        solutions = importlib.import_module('bog.migrations.0011_packed_solutions')
+        words = [(5, None), (300, b"\x01\x02\x03"), (70000, b"\x07")]
+        self.assertEqual(solutions._pack(words), packed.pack(words))
+        self.assertEqual(solutions._unpack(packed.pack(words)), words)
+        points = importlib.import_module('bog.migrations.0013_play_points')
+        records = [(3, None, None), (10, 5, timedelta(seconds=10)), (11, 70000, None)]
+        self.assertEqual(points._archivedwords(packed.packrecords(records)), [None, 5, 70000])
+        self.assertEqual(points._archivedwords(None), [])
+        for spellings, minimumwordlength, handicap in ((["eee", None, "eeeeeeeee"], 3, 0.5),
+                                                       (["ee", None, None], 3, 1.5)):
+            self.assertEqual(points._score(spellings, minimumwordlength, handicap),
+                             scoring.score(spellings, minimumwordlength, handicap))
+
+
+class WordTrieTests(SimpleTestCase):
+    """The word trie finds the same words as the zcat | grep pipeline it replaced."""
+    # Out of order, with capitals, punctuation, accents and short words, all of which grep skips.
+    DICTIONARY = ["cab", "Abc", "abba", "ab", "c'ab", "cabé", "bac", "dab", "baa", "caca", "aac",
+                  "ba", "cabbage", "bacca"]
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.filename = os.path.join(directory.name, "words.gz")
+        with gzip.open(self.filename, "wt", encoding="utf-8") as f:
+            f.write("".join(word + "\n" for word in self.DICTIONARY))
+
+    def grep(self, letters):
+        """The words the old pipeline would have checked, for a grid with these letters."""
+        pipeline = subprocess.run("zcat --stdout -f %s | grep -E '^[%s]{3,}$' -"
+                                  % (self.filename, letters), shell=True,
+                                  stdout=subprocess.PIPE, check=False)
+        return pipeline.stdout.decode().split()
+
+    @unittest.skipUnless(shutil.which("zcat") and shutil.which("grep"), "Needs zcat and grep")
+    def test_grep(self):
+        trie = pyBogged.wordtrie(pyBogged.readdictionary(self.filename))
+        for letters in ("abc", "ab", "c", "abcd", "bac", "xyz"):
+            self.assertEqual(trie.words(letters), self.grep(letters), letters)
+        self.assertEqual(trie.words("abc"), ["cab", "abba", "bac", "baa", "caca", "aac",
+                                             "bacca"])
+
+    def test_words(self):
+        trie = pyBogged.wordtrie(self.DICTIONARY)
+        self.assertEqual(trie.words("abc", 4), ["abba", "caca", "bacca"])
+        self.assertEqual(trie.words("ab", 2), ["abba", "ab", "baa", "ba"])
+        # Only words with no other two letters next to each other.
+        self.assertEqual(trie.words("abc", 3, ["ca", "ab", "ba", "ac"]), ["cab", "bac", "caca"])
+        self.assertEqual(list(pyBogged.readdictionary(self.filename)), self.DICTIONARY)
+        self.assertNotEqual(trie.version, pyBogged.wordtrie(self.DICTIONARY[1:]).version)
+
+
+class EngineTests(SimpleTestCase):
+    """The trie engine finds exactly the words the original checkword engine does."""
+
+    def setUp(self):
+        rng = random.Random(2)
+        words = {"".join(rng.choice("aeiqstu") for _ in range(rng.randint(2, 7)))
+                 for _ in range(3000)}
+        words.update(["quest", "quite", "suq", "qat", "tranq", "queue", "aqua"])
+        patcher = mock.patch.object(pyBogged, '_wordtrie', pyBogged.wordtrie(sorted(words)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def solve(self, layout, width, height, engine):
+        game = pyBogged.bogged("A" * width * height * 6, width, height, engine=engine)
+        game.setlayout(layout)
+        game.solve()
+        return game.words
+
+    def test_engines(self):
+        rng = random.Random(3)
+        for width, height in ((4, 4), (5, 5), (3, 5)):
+            for _ in range(20):
+                layout = "".join(rng.choice("AEIQSTU") for _ in range(width * height))
+                words = self.solve(layout, width, height, "trie")
+                self.assertEqual(words, self.solve(layout, width, height, "checkword"), layout)
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            pyBogged.bogged(DICE, engine="grep")
+
+
+class CompileWordsTests(SimpleTestCase):
+    """The compiled word index maps back in as the same trie."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.dictionary = os.path.join(directory.name, "words")
+        with open(self.dictionary, "w") as f:
+            f.write("".join(word + "\n" for word in WORDS + ["Sees", "see's", "es"]))
+        self.output = os.path.join(directory.name, "words.idx")
+
+    def test_compile(self):
+        call_command('compilewords', dictionary=self.dictionary, output=self.output,
+                     stdout=io.StringIO())
+        built = pyBogged.wordtrie(pyBogged.readdictionary(self.dictionary))
+        loaded = pyBogged.wordtrie.load(self.output)
+        self.assertEqual(loaded.version, built.version)
+        self.assertEqual(len(loaded), len(built))
+        self.assertEqual(loaded.words("es", 2), built.words("es", 2))
+        self.assertEqual(pyBogged.board(2, 2, "SEES").solve(loaded), ["ees", "eses", "see", "sees"])
+        # Mapped, not copied.
+        self.assertIsInstance(loaded.masks, memoryview)
+        self.assertTrue(loaded.masks.readonly)
+
+        with override_settings(BOG_WORDINDEX=self.output), \
+                mock.patch.object(pyBogged, '_wordtrie', None):
+            self.assertEqual(pyBogged.wordindex().version, built.version)
+            self.assertIsInstance(pyBogged.wordindex().masks, memoryview)
+
+    def test_not_an_index(self):
+        with self.assertRaises(ValueError):
+            pyBogged.wordtrie.load(self.dictionary)
+
+
+class BoardTests(SimpleTestCase):
+    """A "Q" is read as "Qu", except at the end of a word, and the board can be shared."""
+
+    def setUp(self):
+        self.trie = pyBogged.wordtrie(["quit", "quits", "siq", "qis", "sqit", "its", "tis"])
+
+    def test_qu(self):
+        grid = pyBogged.board(2, 2, "QIST")
+        self.assertEqual(grid.solve(self.trie), ["quit", "quits", "siq", "its", "tis"])
+        # "Qu" counts as two letters.
+        self.assertEqual(grid.solve(self.trie, 4), ["quit", "quits"])
+        paths = {}
+        grid.solve(self.trie, 3, paths)
+        self.assertEqual(paths["quits"], bytes([0, 1, 3, 2]))
+        self.assertEqual(paths["siq"], bytes([2, 1, 0]))
+        self.assertEqual(grid.find("quits"), paths["quits"])
+        self.assertEqual(grid.find("siq"), paths["siq"])
+        self.assertIsNone(grid.find("tits"))
+
+    def test_neighbors(self):
+        self.assertEqual([len(cells) for cells in pyBogged.board.neighbortable(3, 3)],
+                         [3, 5, 3, 5, 8, 5, 3, 5, 3])
+        self.assertEqual(pyBogged.board.neighbortable(4, 2)[2], (0, 1, 3, 4, 5))
+        self.assertIs(pyBogged.board(3, 3, "A" * 9).neighbors,
+                      pyBogged.board(3, 3, "B" * 9).neighbors)
+        # Anything but a letter can't be part of a word.
+        self.assertEqual(pyBogged.board(2, 2, "QI-T").solve(self.trie), ["quit"])
+        with self.assertRaises(ValueError):
+            pyBogged.board(2, 2, "QIS")
+
+    def test_threads(self):
+        grid = pyBogged.board(4, 4, "QISTITSQSQITTSIQ")
+        words = grid.solve(self.trie)
+        found = []
+        threads = [threading.Thread(target=lambda: found.append(grid.solve(self.trie)))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(found, [words] * 4)
+
+
+@override_settings(BOG_POOL_SIZE=0, BOG_SOLUTIONCACHE_SIZE=0)
+class GeometryTests(WordsMixin, TestCase):
+    """Dice sets and puzzles can be any width and height, not just 4x4 and 5x5."""
+
+    def test_geometry(self):
+        self.assertEqual(pyBogged.geometry("A" * 96), (4, 4))
+        self.assertEqual(pyBogged.geometry("A" * 150), (5, 5))
+        self.assertEqual(pyBogged.geometry("A" * 216), (6, 6))
+        self.assertEqual(pyBogged.geometry("A" * 90, 3, 5), (3, 5))
+        self.assertEqual(pyBogged.geometry("A" * 15, 5, 3, sides=1), (5, 3))
+        for chromosome, width, height in (("A" * 90, None, None), ("A" * 90, 3, None),
+                                          ("A" * 90, 5, 5), ("A" * 90, 0, 5)):
+            with self.assertRaises(ValidationError):
+                pyBogged.geometry(chromosome, width, height)
+
+    def test_rectangle(self):
+        diceset = models.DiceSet.objects.create(description="3x5",
+                                                dice="EEEEEE" * 14 + "SSSSSS", width=3, height=5)
+        self.check(puzzles.roll(diceset), 3, 5)
+
+    def test_same_layout(self):
+        # The same letters in another shape are another board.
+        layout = "ABCDEFGHIJKLMNO"
+        models.Puzzle.objects.create(layout=layout, width=3, height=5)
+        diceset = models.DiceSet.objects.create(description="5x3", dice="ABCDES" * 15, width=5,
+                                                height=3)
+        self.assertEqual(puzzles.store(diceset, [(layout, [], {})]), 1)
+        self.assertEqual(puzzles.store(diceset, [(layout, [], {})]), 0)
+        self.assertEqual(models.Play.objects.filter(puzzle__layout=layout).count(), 1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            models.Puzzle.objects.create(layout=layout, width=3, height=5)
+
+    def test_six(self):
+        diceset = models.DiceSet.objects.create(description="6x6", dice="EEEEEE" * 35 + "SSSSSS")
+        self.assertEqual((diceset.width, diceset.height), (6, 6))
+        self.check(puzzles.roll(diceset), 6, 6)
+
+    def check(self, puzzle, width, height):
+        """The puzzle is width x height, and every word's path is a walk on a board that size."""
+        puzzle.refresh_from_db()
+        self.assertEqual((puzzle.width, puzzle.height, len(puzzle.layout)),
+                         (width, height, width * height))
+        neighbors = pyBogged.board.neighbortable(width, height)
+        solution = puzzle.solved()
+        self.assertEqual(spellings(puzzle), ["eee", "eeee", "ees", "see", "seee"])
+        for word in solution.ids:
+            path = solution.path(word)
+            self.assertEqual(len(set(path)), len(path))
+            for cell, following in zip(path, path[1:]):
+                self.assertIn(following, neighbors[cell])
+
+
+class SolutionCacheTests(WordsMixin, SimpleTestCase):
+    """Rotations and reflections of a board share one cached solution."""
+
+    def turned(self, width, height, layout):
+        """The board's eight rotations and reflections, as (width, height, layout)."""
+        return [(newwidth, newheight, "".join(layout[cell] for cell in cells))
+                for newwidth, newheight, cells
+                in pyBogged.board.symmetrytable(width, height)]
+
+    def test_canonical(self):
+        table = pyBogged.board.symmetrytable(3, 4)
+        self.assertEqual(len(table), 8)
+        self.assertEqual(sorted((width, height) for width, height, cells in table),
+                         [(3, 4)] * 4 + [(4, 3)] * 4)
+        for width, height, cells in table:
+            self.assertEqual(sorted(cells), list(range(12)))
+        boards = self.turned(3, 4, "ABCDEFGHIJKL")
+        self.assertEqual(len(set(boards)), 8)
+        canonical = {pyBogged.board(*turned).canonical()[:3] for turned in boards}
+        self.assertEqual(len(canonical), 1)
+        grid = pyBogged.board(4, 3, "LKJIHGFEDCBA")
+        width, height, layout, cells = grid.canonical()
+        self.assertEqual(layout, "".join(grid.letters[cell] for cell in cells))
+        self.assertEqual(pyBogged.board(2, 2, "ESEE").canonical()[2], "EEES")
+
+    def test_lru(self):
+        cache = pyBogged.solutioncache(2)
+        cache.put("a", [("eee", b"\x00\x01\x02")])
+        cache.put("b", [])
+        self.assertEqual(cache.get("a"), [("eee", b"\x00\x01\x02")])
+        cache.put("c", [])
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), [])
+        self.assertEqual(cache.stats(), {"hits": 2, "diskhits": 0, "misses": 1, "size": 2})
+
+    def test_disk(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        filename = os.path.join(directory.name, "solutions.db")
+        pyBogged.solutioncache(10, filename).put("a", [("eee", b"\x00\x01\x02"), ("see", b"")])
+        cache = pyBogged.solutioncache(10, filename)
+        self.assertEqual(cache.get("a"), [("eee", b"\x00\x01\x02"), ("see", None)])
+        self.assertEqual(cache.get("a"), [("eee", b"\x00\x01\x02"), ("see", None)])
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.stats(), {"hits": 1, "diskhits": 1, "misses": 1, "size": 1})
+
+    def test_turned(self):
+        cache = pyBogged.solutioncache(10)
+        boards = self.turned(3, 4, "SEEEEESEEEEE")
+        solved = []
+        for width, height, layout in boards:
+            game = pyBogged.bogged("A" * width * height * 6, width, height, cache=cache)
+            game.setlayout(layout)
+            game.solve()
+            solved.append(game.words)
+            # The paths are on this board, whichever board was solved to fill the cache.
+            for word, path in game.paths.items():
+                self.assertEqual("".join(layout[cell] for cell in path), word.upper())
+        self.assertEqual(solved, [solved[0]] * 8)
+        self.assertEqual(cache.stats()["misses"], 1)
+        self.assertEqual(cache.stats()["hits"], 7)
+
+
+class PathTests(SimpleTestCase):
+    """Every word comes back from newgame() with a path of adjacent cells that spells it."""
+
+    def setUp(self):
+        rng = random.Random(4)
+        words = {"".join(rng.choice("eiqstu") for _ in range(rng.randint(3, 6)))
+                 for _ in range(2000)}
+        words.update(["quest", "quiet", "quits", "suq", "tuq"])
+        patcher = mock.patch.object(pyBogged, '_wordtrie', pyBogged.wordtrie(sorted(words)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_paths(self):
+        random.seed(5)
+        found = set()
+        for engine in pyBogged.bogged.engines:
+            game = pyBogged.bogged("QUITES" * 16, engine=engine)
+            for _ in range(10):
+                paths = game.newgame()
+                self.assertIs(paths, game.paths)
+                self.assertEqual(sorted(paths), sorted(game.words))
+                neighbors = pyBogged.board.neighbortable(game.width, game.height)
+                for word, path in paths.items():
+                    self.assertEqual(len(set(path)), len(path))
+                    for cell, following in zip(path, path[1:]):
+                        self.assertIn(following, neighbors[cell])
+                    spelled = "".join("QU" if game.layout[cell] == "Q" else game.layout[cell]
+                                      for cell in path)
+                    if word.endswith("q"):
+                        # A bare "Q" at the end.
+                        spelled = spelled[:-1]
+                    self.assertEqual(spelled, word.upper())
+                found.update(paths)
+        self.assertIn("quest", found)
+        self.assertTrue({"suq", "tuq"} & found)
+
+
+@override_settings(BOG_POOL_SIZE=0, BOG_SOLUTIONCACHE_SIZE=0)
+class SolutionTests(WordsMixin, TestCase):
+    """Hints, paths and the reveal at the end of the game come from the packed solution."""
+
+    def setUp(self):
+        super().setUp()
+        diceset = models.DiceSet.objects.create(description="test", dice=DICE)
+        self.puzzle = puzzles.roll(diceset)
+        user = User.objects.create_user('player')
+        player = models.Player.objects.create(user=user, minimumwordlength=0)
+        self.play = models.Play(puzzle=self.puzzle, player=player)
+        self.play.save()
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def find(self, spelling):
+        models.WordList.objects.create(play=self.play, word=models.Word.objects.get(word=spelling),
+                                       foundtime=timedelta(seconds=10))
+
+    def test_wordpath(self):
+        self.assertEqual(self.client.get('/wordlist/%d/path/see/' % self.puzzle.pk).status_code,
+                         403)
+        self.find("see")
+        path = self.client.get('/wordlist/%d/path/see/' % self.puzzle.pk).data['path']
+        self.assertEqual("".join(self.puzzle.layout[cell] for cell in path), "SEE")
+
+    def test_hint(self):
+        for spelling in ("eee", "eeee", "ees", "see"):
+            self.find(spelling)
+        hint = self.client.get('/wordlist/%d/hint/' % self.puzzle.pk).data
+        self.assertEqual(hint['length'], 4)
+        self.assertEqual(self.puzzle.layout[hint['start']], "S")
+        self.find("seee")
+        self.assertEqual(self.client.get('/wordlist/%d/hint/' % self.puzzle.pk).status_code, 404)
+
+    def test_reveal(self):
+        url = '/wordlist/%d/solution/' % self.puzzle.pk
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.play.complete = True
+        self.play.save()
+        words = self.client.get(url).data['words']
+        self.assertEqual([word['word'] for word in words], ["eee", "eeee", "ees", "see", "seee"])
+        for word in words:
+            self.assertEqual("".join(self.puzzle.layout[cell] for cell in word['path']),
+                             word['word'].upper())
+
+
+@override_settings(BOG_POOL_SIZE=0, BOG_SOLUTIONCACHE_SIZE=0)
+class SubmitTests(WordsMixin, TestCase):
+    """Once a puzzle's words are cached, a valid word is an insert and the score updates."""
+
+    def setUp(self):
+        super().setUp()
+        # Puzzle ids are reused from one test to the next.
+        validwords._puzzles.clear()
+        self.addCleanup(validwords._puzzles.clear)
+        diceset = models.DiceSet.objects.create(description="test", dice=DICE)
+        self.puzzle = puzzles.roll(diceset)
+        self.user = User.objects.create_user('player', first_name="A", last_name="Player")
+        models.Player.objects.create(user=self.user, minimumwordlength=0)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def submit(self, word):
+        return self.client.post('/word/', {'puzzle': self.puzzle.pk, 'word': word,
+                                           'foundtime': '00:00:10'}, format='json')
+
+    def test_cached(self):
+        self.assertEqual(self.submit("eee").status_code, 201)
+        # The insert, and adding it to the score and the leaderboard, in a savepoint.
+        with self.assertNumQueries(5):
+            self.assertEqual(self.submit("see").status_code, 201)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.submit("sees").status_code, 409)
+
+    def test_complete(self):
+        self.assertEqual(self.submit("eee").status_code, 201)
+        play = models.Play.objects.get(puzzle=self.puzzle, player=None)
+        play.complete = True
+        play.save()
+        self.assertNotIn(self.puzzle.pk, validwords._puzzles)
+
+    def test_stale(self):
+        # Changes made in other processes are picked up once the play record is old enough.
+        self.submit("eee")
+        models.Play.objects.filter(player__user=self.user).update(repeats=True)
+        with self.settings(BOG_VALIDWORDS_TTL=3600):
+            self.assertEqual(self.submit("eee").status_code, 409)
+        self.assertFalse(models.WordList.objects.filter(word=None).exists())
+        with self.settings(BOG_VALIDWORDS_TTL=0):
+            self.assertEqual(self.submit("eee").status_code, 409)
+        self.assertTrue(models.WordList.objects.filter(word=None).exists())
+
+    def test_score(self):
+        self.submit("eee")
+        play = models.Play.objects.get(player__user=self.user)
+        play.missed = play.repeats = True
+        play.handicap = 2.0
+        play.save()
+        validwords.forget(self.puzzle.pk)
+        self.submit("seee")
+        self.submit("seee")
+        self.submit("eeeeeeeeeeeeeeeeeeeeeeee")
+        play.refresh_from_db()
+        # The handicap is applied to the total, so the first word counts double too, now the
+        # handicap has changed.
+        self.assertEqual((play.points, play.score), (1 + 1 - 1 - 1, 2 * (1 + 1 - 1 - 1)))
+
+        # Drift, which recomputescores puts right.
+        models.Play.objects.filter(pk=play.pk).update(score=100)
+        out = io.StringIO()
+        call_command('recomputescores', '--all', '--check', stdout=out)
+        self.assertIn("1 had drifted by 100", out.getvalue())
+        call_command('recomputescores', '--all', '--chunk', '1', stdout=out)
+        play.refresh_from_db()
+        self.assertEqual(play.score, 2 * (1 + 1 - 1 - 1))
+
+    def test_handicap(self):
+        # Applied to the total, not rounded away word by word.
+        play = models.Play.objects.get(puzzle=self.puzzle, player=None)
+        play.handicap = 0.5
+        play.save()
+        validwords.forget(self.puzzle.pk)
+        for word in ("eee", "see", "ees"):
+            self.submit(word)
+        play = models.Play.objects.get(player__user=self.user)
+        self.assertEqual((play.points, play.score), (3, 2))
+        self.assertEqual(models.Standing.objects.get(play=play).score, 2)
+        self.assertEqual(scoring.score(["eee"] * 4, 3, 1.5), (4, 6))
+        self.assertEqual(scoring.score([None, None, "eeee"], 3, 0.5), (-1, -1))
+
+    def test_no_puzzle(self):
+        self.puzzle.pooled = True
+        self.puzzle.save()
+        self.assertEqual(self.submit("eee").status_code, 400)
+
+
+@override_settings(BOG_POOL_SIZE=0, BOG_SOLUTIONCACHE_SIZE=0)
+class ListWordsTests(WordsMixin, TestCase):
+    """Listing a player's words takes the same queries, however many words and players."""
+
+    def setUp(self):
+        super().setUp()
+        diceset = models.DiceSet.objects.create(description="test", dice=DICE)
+        self.puzzle = puzzles.roll(diceset)
+        self.words = dict(models.Word.objects.values_list('word', 'pk'))
+        self.players = []
+
+    def player(self, *words):
+        user = User.objects.create_user('player%d' % len(self.players),
+                                        first_name="Player", last_name=str(len(self.players)))
+        player = models.Player.objects.create(user=user, minimumwordlength=0)
+        play = models.Play.objects.create(puzzle=self.puzzle, player=player)
+        for word in words:
+            models.WordList.objects.create(play=play, word_id=self.words[word],
+                                           foundtime=timedelta(seconds=10))
+        self.players.append(user)
+        return user
+
+    def listwords(self, user, **headers):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.get('/wordlist/%d/' % self.puzzle.pk, **headers).data
+
+    def get(self, user, query="", **headers):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.get('/wordlist/%d/%s' % (self.puzzle.pk, query), **headers)
+
+    def test_players(self):
+        user = self.player("eee", "see")
+        self.player("see")
+        self.player("eee", "see", "seee")
+        data = self.listwords(user)
+        self.assertEqual([word['word'] for word in data['wordlist_set']], ["eee", "see"])
+        self.assertEqual([[player['player'] for player in word['players']]
+                          for word in data['wordlist_set']],
+                         [["Player 2"], ["Player 1", "Player 2"]])
+
+    def test_queries(self):
+        user = self.player("eee")
+        self.player("eee")
+        # The play, the cursor, the player's words, and everybody else's, in the table and in
+        # archived plays.
+        with self.assertNumQueries(5):
+            self.listwords(user)
+        for _ in range(5):
+            self.player("eee", "see", "seee")
+        models.WordList.objects.create(play=models.Play.objects.get(player__user=user),
+                                       word_id=self.words["see"], foundtime=timedelta(seconds=20))
+        with self.assertNumQueries(5):
+            self.listwords(user)
+
+    def test_since(self):
+        user = self.player("eee")
+        other = self.player("see")
+        cursor = self.listwords(user)['cursor']
+        self.assertEqual(self.get(user, "?since=%d" % cursor).data['wordlist_set'], [])
+
+        # A new word of the player's own, which somebody else found first, and somebody else
+        # finding one the player already had.
+        play = models.Play.objects.get(player__user=user)
+        models.WordList.objects.create(play=play, word_id=self.words["see"],
+                                       foundtime=timedelta(seconds=20))
+        models.WordList.objects.create(play=models.Play.objects.get(player__user=other),
+                                       word_id=self.words["eee"], foundtime=timedelta(seconds=30))
+        data = self.get(user, "?since=%d" % cursor).data
+        self.assertEqual([(word['word'], [player['foundtime'] for player in word['players']])
+                          for word in data['wordlist_set']],
+                         [("eee", ["00:00:30"]), ("see", ["00:00:10"])])
+        self.assertGreater(data['cursor'], cursor)
+
+        # Finding a word somebody found earlier brings their find along with it, but later on,
+        # only the new finds of it are listed.
+        self.player("seee")
+        cursor = self.listwords(user)['cursor']
+        models.WordList.objects.create(play=play, word_id=self.words["seee"],
+                                       foundtime=timedelta(seconds=40))
+        data = self.get(user, "?since=%d" % cursor).data
+        self.assertEqual([(word['word'], [player['foundtime'] for player in word['players']])
+                          for word in data['wordlist_set']],
+                         [("seee", ["00:00:10"])])
+        models.WordList.objects.create(play=models.Play.objects.get(player__user=other),
+                                       word_id=self.words["seee"], foundtime=timedelta(seconds=50))
+        data = self.get(user, "?since=%d" % data['cursor']).data
+        self.assertEqual([(word['word'], [player['foundtime'] for player in word['players']])
+                          for word in data['wordlist_set']],
+                         [("seee", ["00:00:50"])])
+
+        self.assertEqual(self.get(user, "?since=soon").status_code, 400)
+
+    def test_etag(self):
+        user = self.player("eee")
+        response = self.get(user)
+        with self.assertNumQueries(2):
+            cached = self.get(user, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.player("see")
+        self.assertEqual(self.get(user, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+
+@override_settings(BOG_POOL_SIZE=0, BOG_SOLUTIONCACHE_SIZE=0, BOG_STREAM_KEEPALIVE=0.01)
+class StreamTests(WordsMixin, TestCase):
+    """Found words are pushed to the other players of the puzzle who have found them too."""
+    brokerclass = broker.LocalBroker
+
+    def setUp(self):
+        super().setUp()
+        validwords._puzzles.clear()
+        self.addCleanup(validwords._puzzles.clear)
+        patcher = mock.patch.object(broker, '_broker', self.brokerclass())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        diceset = models.DiceSet.objects.create(description="test", dice=DICE)
+        self.puzzle = puzzles.roll(diceset)
+        self.clients = []
+        for name in ("One", "Two", "Three"):
+            user = User.objects.create_user(name, first_name=name)
+            models.Player.objects.create(user=user, minimumwordlength=0)
+            client = APIClient()
+            client.force_authenticate(user)
+            self.clients.append(client)
+
+    def submit(self, client, word):
+        return client.post('/word/', {'puzzle': self.puzzle.pk, 'word': word,
+                                      'foundtime': '00:00:10'}, format='json')
+
+    def stream(self, client):
+        response = client.get('/wordlist/%d/stream/' % self.puzzle.pk,
+                              HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, 200)
+        self.addCleanup(response.close)
+        return response
+
+    def next(self, response):
+        """The next event from the stream, skipping keepalives, or None if it's quiet."""
+        for _, chunk in zip(range(10), response.streaming_content):
+            chunk = chunk.decode()
+            if chunk.startswith("event:"):
+                lines = chunk.split("\n")
+                return lines[0][len("event: "):], json.loads(lines[2][len("data: "):])
+        return None
+
+    def test_stream(self):
+        one, two, three = self.clients
+        self.submit(one, "eee")
+        stream = self.stream(one)
+        self.submit(three, "see")
+        self.submit(two, "eee")
+        name, event = self.next(stream)
+        self.assertEqual((name, event['word'], event['player']), ("player", "eee", "Two"))
+        self.submit(one, "see")
+        name, event = self.next(stream)
+        self.assertEqual((name, event['word'], event['player']), ("word", "see", "One"))
+        self.submit(three, "eee")
+        self.submit(two, "see")
+        name, event = self.next(stream)
+        self.assertEqual((name, event['word'], event['player']), ("player", "eee", "Three"))
+        name, event = self.next(stream)
+        self.assertEqual((name, event['word'], event['player']), ("player", "see", "Two"))
+        self.assertIsNone(self.next(stream))
+
+    def test_unsubscribe(self):
+        self.submit(self.clients[0], "eee")
+        stream = self.stream(self.clients[0])
+        self.assertIsNone(self.next(stream))
+        self.assertEqual(len(broker.broker().subscriptions), 1)
+        stream.close()
+        self.assertEqual(len(broker.broker().subscriptions), 0)
+
+
+@override_settings(BOG_BROKER_POLL=0.001)
+class DatabaseStreamTests(StreamTests):
+    """The same, with the words found by polling the database, whichever process found them."""
+    brokerclass = broker.DatabaseBroker
+
+    @unittest.skip("Nothing is kept for each subscription")
+    def test_unsubscribe(self):
+        pass
+
+
+@override_settings(BOG_POOL_SIZE=0, BOG_SOLUTIONCACHE_SIZE=0, BOG_LEADERBOARD_TTL=3600)
+class LeaderboardTests(WordsMixin, TestCase):
+    """The leaderboard is read once, and kept up to date as words are found."""
+
+    def setUp(self):
+        super().setUp()
+        for cache in (validwords._puzzles, leaderboard._puzzles):
+            cache.clear()
+            self.addCleanup(cache.clear)
+        diceset = models.DiceSet.objects.create(description="test", dice=DICE)
+        self.puzzle = puzzles.roll(diceset)
+        self.clients = []
+        for name in ("One", "Two", "Three"):
+            user = User.objects.create_user(name, first_name=name)
+            models.Player.objects.create(user=user, minimumwordlength=0)
+            client = APIClient()
+            client.force_authenticate(user)
+            self.clients.append(client)
+
+    def submit(self, client, *words):
+        for word in words:
+            client.post('/word/', {'puzzle': self.puzzle.pk, 'word': word,
+                                   'foundtime': '00:00:10'}, format='json')
+
+    def standings(self, client):
+        return client.get('/puzzle/%d/standings/?top=2' % self.puzzle.pk).data
+
+    def test_standings(self):
+        one, two, three = self.clients
+        self.submit(one, "eee")
+        self.submit(two, "eee", "seee")
+        self.submit(three, "eee")
+        data = self.standings(three)
+        self.assertEqual(data['top'], [{'rank': 1, 'player': "Two", 'score': 2},
+                                       {'rank': 2, 'player': "One", 'score': 1}])
+        self.assertEqual((data['players'], data['rank'], data['score']), (3, 2, 1))
+
+        # Found in this process, so the leaderboard in memory is updated without reading it
+        # again.
+        self.submit(three, "see", "seee")
+        with self.assertNumQueries(1):
+            data = self.standings(one)
+        self.assertEqual(data['top'], [{'rank': 1, 'player': "Three", 'score': 3},
+                                       {'rank': 2, 'player': "Two", 'score': 2}])
+        self.assertEqual((data['rank'], data['score']), (3, 1))
+        self.assertEqual(sorted(models.Standing.objects.values_list('player', 'score')),
+                         [("One", 1), ("Three", 3), ("Two", 2)])
+
+    def test_joined(self):
+        one, two, three = self.clients
+        self.submit(one, "eee")
+        self.assertEqual(self.standings(one)['players'], 1)
+        # A new player is on the leaderboard in memory straight away.
+        self.submit(two, "eee", "seee")
+        with self.assertNumQueries(1):
+            data = self.standings(one)
+        self.assertEqual(data['players'], 2)
+        self.assertEqual(data['top'], [{'rank': 1, 'player': "Two", 'score': 2},
+                                       {'rank': 2, 'player': "One", 'score': 1}])
+
+    def test_migration(self):
+        # Plays from before there were standings get them when migrating (see 0007).
+        self.submit(self.clients[0], "eee")
+        models.Standing.objects.all().delete()
+        migration = importlib.import_module('bog.migrations.0007_standing')
+        migration.standings(apps, None)
+        self.assertEqual(list(models.Standing.objects.values_list('player', 'score')),
+                         [("One", 1)])
+
+
+@override_settings(BOG_POOL_SIZE=0, BOG_SOLUTIONCACHE_SIZE=0)
+class BatchTests(WordsMixin, TestCase):
+    """A batch of words is checked one by one, and stored all at once."""
+
+    def setUp(self):
+        super().setUp()
+        for cache in (validwords._puzzles, leaderboard._puzzles):
+            cache.clear()
+            self.addCleanup(cache.clear)
+        diceset = models.DiceSet.objects.create(description="test", dice=DICE)
+        self.puzzle = puzzles.roll(diceset, options={'missed': True, 'repeats': True})
+        self.user = User.objects.create_user('player', first_name="A", last_name="Player")
+        models.Player.objects.create(user=self.user, minimumwordlength=0)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def batch(self, *words):
+        return self.client.post('/word/batch/', {
+            'puzzle': self.puzzle.pk,
+            'words': [{'word': word, 'foundtime': '00:00:%02d' % i}
+                      for i, word in enumerate(words)],
+        }, format='json')
+
+    def test_batch(self):
+        self.client.post('/word/', {'puzzle': self.puzzle.pk, 'word': "eee",
+                                    'foundtime': '00:00:01'}, format='json')
+        response = self.batch("see", "eee", "sss", "seee", "see")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([result['result'] for result in response.data['results']],
+                         ["accepted", "repeat", "missed", "accepted", "repeat"])
+        play = models.Play.objects.get(player__user=self.user)
+        found = list(play.wordlist_set.values_list('word__word', flat=True))
+        self.assertEqual(sorted(word for word in found if word), ["eee", "see", "seee"])
+        self.assertEqual(found.count(None), 3)
+        self.assertEqual(play.score, 3 - 3)
+        self.assertEqual(models.Standing.objects.get(play=play).score, 0)
+
+    def test_queries(self):
+        self.batch("eee")
+        # Already found words, the insert, the score, the standing, the new ids, and the
+        # savepoint around it all.
+        with self.assertNumQueries(7):
+            self.batch("see", "seee", "eeee")
+        with self.assertNumQueries(7):
+            self.batch("sees", "ees", "eeee", "see")
+
+    def test_no_puzzle(self):
+        self.puzzle.pooled = True
+        self.puzzle.save()
+        self.assertEqual(self.batch("eee").status_code, 400)
+
+
+@override_settings(BOG_POOL_SIZE=0, BOG_SOLUTIONCACHE_SIZE=0, BOG_WRITEBEHIND=True,
+                   BOG_WRITEBEHIND_DURABLE=False)
+class WriteBehindTests(WordsMixin, TestCase):
+    """Word submissions are answered from memory, and written when the writer gets to them."""
+
+    def setUp(self):
+        super().setUp()
+        for cache in (validwords._puzzles, leaderboard._puzzles):
+            cache.clear()
+            self.addCleanup(cache.clear)
+        # Not started, so the test decides when words are written.
+        self.writer = writebehind.Writer()
+        patcher = mock.patch.object(writebehind, '_writer', self.writer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        diceset = models.DiceSet.objects.create(description="test", dice=DICE)
+        self.puzzle = puzzles.roll(diceset, options={'repeats': True})
+        self.user = User.objects.create_user('player', first_name="A", last_name="Player")
+        models.Player.objects.create(user=self.user, minimumwordlength=0)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def submit(self, word):
+        return self.client.post('/word/', {'puzzle': self.puzzle.pk, 'word': word,
+                                           'foundtime': '00:00:10'}, format='json')
+
+    def test_writebehind(self):
+        self.assertEqual(self.submit("eee").status_code, 201)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.submit("seee").status_code, 201)
+            self.assertEqual(self.submit("eee").status_code, 409)
+            self.assertEqual(self.submit("sss").status_code, 409)
+        play = models.Play.objects.get(player__user=self.user)
+        self.assertEqual(play.wordlist_set.count(), 0)
+
+        self.writer.write()
+        found = list(play.wordlist_set.values_list('word__word', flat=True))
+        self.assertEqual(sorted(word for word in found if word), ["eee", "seee"])
+        self.assertEqual(found.count(None), 1)
+        play.refresh_from_db()
+        self.assertEqual(play.score, 1 + 1 - 1)
+        self.assertEqual(models.Standing.objects.get(play=play).score, 1)
+
+    def test_repeat_elsewhere(self):
+        # Found by another process, which this one doesn't know about.
+        self.submit("eee")
+        self.writer.write()
+        play = models.Play.objects.get(player__user=self.user)
+        validwords.get(self.puzzle.pk).found[play.pk] = set()
+        self.assertEqual(self.submit("eee").status_code, 201)
+        self.submit("see")
+        self.writer.write()
+        # Written as a repeat, as it would have been had it been written straight away.
+        found = list(play.wordlist_set.values_list('word__word', flat=True))
+        self.assertEqual(sorted(word for word in found if word), ["eee", "see"])
+        self.assertEqual(found.count(None), 1)
+        play.refresh_from_db()
+        self.assertEqual(play.score, 1 + 1 - 1)
+
+    def test_batch(self):
+        # Words queued one at a time and in batches are claimed, and written, the same way.
+        self.submit("eee")
+        response = self.client.post('/word/batch/', {'puzzle': self.puzzle.pk, 'words': [
+            {'word': "eee", 'foundtime': '00:00:11'}, {'word': "see", 'foundtime': '00:00:12'},
+        ]}, format='json')
+        self.assertEqual([result['result'] for result in response.data['results']],
+                         ["repeat", "accepted"])
+        self.assertEqual(self.submit("see").status_code, 409)
+        play = models.Play.objects.get(player__user=self.user)
+        self.assertEqual(play.wordlist_set.count(), 0)
+
+        self.writer.write()
+        found = list(play.wordlist_set.values_list('word__word', flat=True))
+        self.assertEqual(sorted(word for word in found if word), ["eee", "see"])
+        self.assertEqual(found.count(None), 2)
+        play.refresh_from_db()
+        self.assertEqual(play.score, 1 + 1 - 2)
+
+    @override_settings(BOG_WRITEBEHIND_DURABLE=True, BOG_WRITEBEHIND_TIMEOUT=0.01)
+    def test_timeout(self):
+        self.assertEqual(self.submit("eee").status_code, 503)
+        # It's still written, so it's found already.
+        self.writer.write()
+        play = models.Play.objects.get(player__user=self.user)
+        self.assertEqual(list(play.wordlist_set.values_list('word__word', flat=True)), ["eee"])
+        with self.settings(BOG_WRITEBEHIND_DURABLE=False):
+            self.assertEqual(self.submit("eee").status_code, 409)
+
+    def test_failed(self):
+        # Waiting for a word that can't be written.
+        self.submit("eee")
+        self.writer.write()
+        play = models.Play.objects.get(player__user=self.user)
+        word = models.Word.objects.get(word="see")
+        puzzlewords = validwords.get(self.puzzle.pk)
+        self.assertTrue(puzzlewords.claim(play, word.pk))
+        errors = []
+
+        def submit():
+            try:
+                self.writer.submit(models.WordList(word=word, play=play,
+                                                   foundtime=timedelta(seconds=10)),
+                                   "see", 1, self.user, durable=True)
+            except Exception as error:
+                errors.append(error)
+        thread = threading.Thread(target=submit)
+        thread.start()
+        while self.writer.queue.empty():
+            time.sleep(0.001)
+        with mock.patch.object(models.WordList.objects, 'bulk_create', side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                self.writer.write()
+        thread.join()
+        self.assertEqual([type(error) for error in errors], [writebehind.Unavailable])
+        self.assertEqual(play.wordlist_set.count(), 1)
+        # It can be found again.
+        self.assertTrue(puzzlewords.claim(play, word.pk))
+
+
+@override_settings(BOG_POOL_SIZE=0, BOG_SOLUTIONCACHE_SIZE=0)
+class ListPuzzlesTests(WordsMixin, TestCase):
+    """Open puzzles are listed newest first, a page at a time, in a fixed number of queries."""
+
+    def setUp(self):
+        super().setUp()
+        # Plenty of different layouts.
+        diceset = models.DiceSet.objects.create(description="test", dice="ABCDES" * 16)
+        self.user = User.objects.create_user('maker', first_name="Puzzle", last_name="Maker")
+        self.puzzles = [puzzles.roll(diceset, createdby=self.user) for _ in range(25)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_pages(self):
+        # The page, and the puzzles' options.
+        with self.assertNumQueries(2):
+            page = self.client.get('/puzzle/').data
+        self.assertEqual(len(page['results']), 20)
+        self.assertEqual(page['results'][0]['options'][0]['id'],
+                         models.Play.objects.get(puzzle=self.puzzles[-1], player=None).pk)
+        listed = [puzzle['id'] for puzzle in page['results']]
+        page = self.client.get(page['next']).data
+        listed += [puzzle['id'] for puzzle in page['results']]
+        self.assertEqual(listed, [puzzle.pk for puzzle in reversed(self.puzzles)])
+        self.assertIsNone(page['next'])
+
+    def test_complete(self):
+        play = models.Play.objects.get(puzzle=self.puzzles[-1], player=None)
+        play.complete = True
+        play.save()
+        page = self.client.get('/puzzle/').data
+        self.assertNotIn(self.puzzles[-1].pk, [puzzle['id'] for puzzle in page['results']])
+
+    def test_same_time(self):
+        # The cursor counts its way past puzzles created at the same time as the last one.
+        models.Puzzle.objects.update(created=self.puzzles[0].created)
+        page = self.client.get('/puzzle/').data
+        listed = [puzzle['id'] for puzzle in page['results']]
+        page = self.client.get(page['next']).data
+        listed += [puzzle['id'] for puzzle in page['results']]
+        self.assertEqual(listed, [puzzle.pk for puzzle in reversed(self.puzzles)])
+
+    def test_migration(self):
+        # Copied from each puzzle's default play record, all at once.
+        play = models.Play.objects.get(puzzle=self.puzzles[0], player=None)
+        play.complete = True
+        play.save()
+        models.Puzzle.objects.update(is_open=True, created=timezone.now())
+        migration = importlib.import_module('bog.migrations.0008_open_puzzles')
+        with self.assertNumQueries(1):
+            migration.copy(apps, None)
+        self.assertEqual(models.Puzzle.objects.filter(is_open=False).get(), self.puzzles[0])
+        for puzzle in models.Puzzle.objects.all():
+            self.assertEqual(puzzle.created,
+                             models.Play.objects.get(puzzle=puzzle, player=None).date)
+
+
+@override_settings(BOG_POOL_SIZE=0, BOG_SOLUTIONCACHE_SIZE=0, BOG_PUZZLE_WORKERS=0)
+class PuzzleJobTests(WordsMixin, TestCase):
+    """With the pool empty, asking for a puzzle answers with a job to poll."""
+
+    def setUp(self):
+        super().setUp()
+        self.diceset = models.DiceSet.objects.create(description="test", dice=DICE)
+        self.user = User.objects.create_user('maker', first_name="Puzzle", last_name="Maker")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create(self, url='/puzzle/'):
+        return self.client.post(url, {'diceset': self.diceset.pk, 'layout': "x",
+                                      'options': [{'minimumwordlength': 4,
+                                                   'time': '00:02:00'}]}, format='json')
+
+    def test_job(self):
+        response = self.create()
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response['Location'], response.data['url'])
+        job = self.client.get(response.data['url']).data
+        self.assertEqual(job['status'], models.PuzzleJob.DONE)
+        puzzle = models.Puzzle.objects.get(pk=job['puzzle']['id'])
+        self.assertEqual(puzzle.createdby, self.user)
+        play = models.Play.objects.get(puzzle=puzzle, player=None)
+        self.assertEqual(play.minimumwordlength, 4)
+        self.assertEqual(play.time, timedelta(minutes=2))
+        self.assertEqual(len(puzzle.solved()), 5)
+
+    def test_failed(self):
+        with mock.patch.object(puzzles, 'roll', side_effect=ValueError("No dice")), \
+                self.assertLogs('bog.puzzles', 'ERROR'):
+            response = self.create()
+        job = self.client.get(response.data['url']).data
+        self.assertEqual(job['status'], models.PuzzleJob.FAILED)
+        self.assertEqual(job['error'], "No dice")
+
+    def test_others(self):
+        url = self.create().data['url']
+        other = User.objects.create_user('other')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_pooled(self):
+        puzzles.fill(self.diceset, 1)
+        response = self.create()
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(models.PuzzleJob.objects.exists())
+
+    def test_sync(self):
+        self.assertEqual(self.create('/puzzle/?sync=1').status_code, 403)
+        self.assertEqual(self.create('/puzzle/?sync=maybe').status_code, 400)
+        self.assertFalse(models.Puzzle.objects.exists())
+        self.user.is_staff = True
+        self.user.save()
+        response = self.create('/puzzle/?sync=1')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['wordcount'], 5)
+        self.assertFalse(models.PuzzleJob.objects.exists())
+        # Anything false still gets a job.
+        self.assertEqual(self.create('/puzzle/?sync=0').status_code, 202)
+        self.assertEqual(self.create('/puzzle/?sync=false').status_code, 202)
+
+
+@override_settings(BOG_POOL_SIZE=0, BOG_SOLUTIONCACHE_SIZE=0, BOG_PUZZLE_WORKERS=1)
+class PuzzleWorkerTests(TransactionTestCase):
+    """Puzzle jobs run in real worker processes, and are failed if a worker can't run them."""
+
+    def setUp(self):
+        self.diceset = models.DiceSet.objects.create(description="test", dice=DICE)
+        self.user = User.objects.create_user('maker')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.filename = os.path.join(directory.name, "jobs.sqlite3")
+
+    def executor(self):
+        """One worker, with a copy of the test database as it is now, since a worker can't see
+        the one in memory."""
+        copy = sqlite3.connect(self.filename)
+        connection.ensure_connection()
+        connection.connection.backup(copy)
+        copy.close()
+        databases = {'default': dict(settings.DATABASES['default'], NAME=self.filename)}
+        executor = puzzles.newexecutor(1, databases)
+        self.addCleanup(executor.shutdown)
+        return executor
+
+    def test_worker(self):
+        job = models.PuzzleJob.objects.create(diceset=self.diceset, createdby=self.user)
+        self.executor().submit(jobs.run, job.pk).result(timeout=60)
+        copy = sqlite3.connect(self.filename)
+        self.addCleanup(copy.close)
+        status, puzzle = copy.execute("SELECT status, puzzle_id FROM bog_puzzlejob WHERE id = ?",
+                                      [job.pk]).fetchone()
+        self.assertEqual(status, models.PuzzleJob.DONE)
+        self.assertIsNotNone(puzzle)
+
+    def test_worker_failed(self):
+        # The worker's copy of the database is made before the job is, so it can't find it.
+        with mock.patch.object(puzzles, '_executor', self.executor()), \
+                self.assertLogs('bog.puzzles', 'ERROR'):
+            job = puzzles.start(self.diceset, self.user)
+            for _ in range(600):
+                job.refresh_from_db()
+                if job.status == models.PuzzleJob.FAILED:
+                    break
+                time.sleep(0.1)
+        self.assertEqual(job.status, models.PuzzleJob.FAILED)
+        self.assertIn("does not exist", job.error)
+
+
+@override_settings(BOG_POOL_SIZE=0, BOG_SOLUTIONCACHE_SIZE=0, BOG_PUZZLE_WORKERS=0,
+                   BOG_GENERATE_ATTEMPTS=64, BOG_GENERATE_BATCH=16)
+class ConstraintsTests(WordsMixin, TestCase):
+    """Puzzles can be asked for with limits on their words, and only boards that fit are kept."""
+
+    def setUp(self):
+        super().setUp()
+        self.diceset = models.DiceSet.objects.create(description="test", dice=DICE)
+        self.user = User.objects.create_user('maker', first_name="Puzzle", last_name="Maker",
+                                             is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create(self, url='/puzzle/?sync=1', **constraints):
+        return self.client.post(url, dict(constraints, diceset=self.diceset.pk, layout="x",
+                                          options=[{}]), format='json')
+
+    def test_fits(self):
+        # Every board from DICE has the same five words, the longest of them four letters.
+        response = self.create(minwords=5, maxwords=5, longest=4)
+        self.assertEqual(response.status_code, 201)
+
+    def test_no_fit(self):
+        for constraints in ({'minwords': 6}, {'maxwords': 4}, {'longest': 5}):
+            response = self.create(**constraints)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("64 rolls", response.data[0])
+        self.assertFalse(models.Puzzle.objects.exists())
+
+    def test_invalid(self):
+        self.assertEqual(self.create(minwords=10, maxwords=5).status_code, 400)
+
+    def test_job(self):
+        response = self.create('/puzzle/', longest=5)
+        self.assertEqual(response.status_code, 202)
+        job = self.client.get(response.data['url']).data
+        self.assertEqual(job['status'], models.PuzzleJob.FAILED)
+        self.assertIn("a word of 5 letters", job['error'])
+
+    def test_pool(self):
+        puzzles.fill(self.diceset, 1)
+        self.assertEqual(self.create(maxwords=4).status_code, 400)
+        self.assertTrue(models.Puzzle.objects.filter(pooled=True).exists())
+        self.assertEqual(self.create(minwords=5).status_code, 201)
+        self.assertFalse(models.Puzzle.objects.filter(pooled=True).exists())
+
+    def test_solved_once(self):
+        # Only the board that's kept is solved properly, and goes in the solution cache.
+        game = pyBogged.bogged("ABCDES" * 16, cache=pyBogged.solutioncache(100))
+        with mock.patch.object(game, 'solve', wraps=game.solve) as solve:
+            game.newgame(pyBogged.constraints(minwords=1), attempts=1000)
+        solve.assert_called_once_with()
+        self.assertTrue(game.words)
+        self.assertEqual(game.cache.stats()['misses'], 1)
+
+
+@override_settings(BOG_POOL_SIZE=0, BOG_SOLUTIONCACHE_SIZE=0)
+class GeneratePuzzlesTests(WordsMixin, TestCase):
+    """Puzzles are generated in bulk, a chunk at a time, without repeating a layout."""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+
+    def generate(self, diceset, *args):
+        out = io.StringIO()
+        call_command('generatepuzzles', str(diceset.pk), '--workers', '0', *args, stdout=out)
+        return out.getvalue()
+
+    def test_generate(self):
+        diceset = models.DiceSet.objects.create(description="test", dice="ABCDES" * 16)
+        rolled = puzzles.roll(diceset)
+        with mock.patch.object(puzzles, 'wordids', wraps=puzzles.wordids) as wordids:
+            out = self.generate(diceset, '--count', '25', '--chunk', '10', '--batch', '7')
+        self.assertIn("Created 25 puzzles", out)
+        self.assertEqual(self.client.get('/puzzle/').data['results'][0]['createdby'], None)
+        # One lookup of the words for each chunk.
+        self.assertEqual(wordids.call_count, 3)
+        self.assertEqual(models.Puzzle.objects.exclude(pk=rolled.pk).count(), 25)
+        for puzzle in models.Puzzle.objects.exclude(pk=rolled.pk):
+            self.assertTrue(models.Play.objects.filter(puzzle=puzzle, player=None).exists())
+            paths = {}
+            words = pyBogged.board(puzzle.width, puzzle.height, puzzle.layout)\
+                .solve(pyBogged.wordindex(), 3, paths)
+            self.assertEqual(spellings(puzzle), sorted(words))
+            solution = puzzle.solved()
+            for word in models.Word.objects.filter(pk__in=list(solution)):
+                self.assertEqual(solution.path(word.pk), paths[word.word])
+
+    def test_store_queries(self):
+        diceset = models.DiceSet.objects.create(description="test", dice="ABCDES" * 16)
+        games = list({layout: (layout, words, paths) for layout, words, paths
+                      in pyBogged.solvedgames(diceset.dice, 4, 4, 80)}.values())[:60]
+        puzzles.wordids(sorted({word for layout, words, paths in games for word in words}))
+        # The layouts taken, the words, the puzzles, their ids and their plays, and the
+        # savepoint around them, however many games there are.
+        for chunk in (games[:10], games[10:50]):
+            with self.assertNumQueries(7):
+                self.assertEqual(puzzles.store(diceset, chunk), len(chunk))
+        # The layouts already taken are looked up once, and left out.
+        with self.assertNumQueries(7):
+            self.assertEqual(puzzles.store(diceset, games[40:]), 10)
+
+    def test_run_out(self):
+        # Only 16 layouts: wherever the S lands.
+        diceset = models.DiceSet.objects.create(description="test", dice=DICE)
+        self.generate(diceset, '--count', '3')
+        out = self.generate(diceset, '--count', '30', '--batch', '50')
+        self.assertIn("No new boards turned up", out)
+        self.assertEqual(models.Puzzle.objects.values('layout').distinct().count(),
+                         models.Puzzle.objects.count())
+        self.assertLessEqual(models.Puzzle.objects.count(), 16)
+
+
+class EvolveDiceTests(WordsMixin, TestCase):
+    """Dice sets can be evolved, with a checkpoint to carry on from, and the best ones saved."""
+
+    def setUp(self):
+        super().setUp()
+        # Rolling real boards makes the fitness random, so measure how many different letters
+        # each set has instead. DICE has the fewest possible, so something bred from it wins.
+        patcher = mock.patch('bog.management.commands.evolvedice.wordcounts',
+                             lambda dice, width, height, samples: [len(set(dice))] * samples)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        models.DiceSet.objects.create(description="test", dice=DICE)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.checkpoint = os.path.join(directory.name, "evolve.json")
+
+    def evolve(self, *args):
+        out = io.StringIO()
+        call_command('evolvedice', '--population', '4', '--samples', '2', '--processes', '0',
+                     '--seed', '1', '--save', '1', '--checkpoint', self.checkpoint, *args,
+                     stdout=out)
+        return out.getvalue()
+
+    def test_resume(self):
+        out = self.evolve('--generations', '2', '--save', '0')
+        self.assertIn("Generation 2:", out)
+        with open(self.checkpoint) as checkpoint:
+            state = json.load(checkpoint)
+        self.assertEqual(state['generation'], 2)
+        self.assertEqual(len(state['population']), 4)
+
+        self.assertEqual(len(state['scores']), len(set(state['population'])))
+
+        out = self.evolve('--generations', '3', '--resume')
+        self.assertNotIn("Generation 1:", out)
+        self.assertIn("Generation 3:", out)
+        with open(self.checkpoint) as checkpoint:
+            state = json.load(checkpoint)
+        best = state['population'][0]
+        self.assertEqual(state['scores'][best], [len(set(best)), 0])
+        self.assertGreater(len(set(best)), len(set(DICE)))
+        self.assertIn("Saved dice set", out)
+        self.assertEqual(models.DiceSet.objects.exclude(dice=DICE).get().dice, best)
+        self.assertEqual(best, pyBogged.normalize(best))
+
+    def test_repeatable(self):
+        # Stopping and resuming makes no difference to a seeded run.
+        straight = os.path.join(self.directory, "straight.json")
+        self.evolve('--generations', '3', '--save', '0', '--checkpoint', straight)
+        self.evolve('--generations', '2', '--save', '0')
+        self.evolve('--generations', '3', '--save', '0', '--resume')
+        with open(straight) as one, open(self.checkpoint) as other:
+            self.assertEqual(json.load(one), json.load(other))
+        self.assertEqual(models.DiceSet.objects.count(), 1)
+
+    def test_resume_missing(self):
+        with self.assertRaises(CommandError):
+            self.evolve('--resume')
+
+
+@override_settings(BOG_POOL_SIZE=0, BOG_SOLUTIONCACHE_SIZE=0)
+class ArchiveTests(WordsMixin, TestCase):
+    """Completed plays' word lists are packed away, and read back just the same."""
+
+    def setUp(self):
+        super().setUp()
+        for cache in (validwords._puzzles, leaderboard._puzzles):
+            cache.clear()
+            self.addCleanup(cache.clear)
+        diceset = models.DiceSet.objects.create(description="test", dice=DICE)
+        self.puzzle = puzzles.roll(diceset)
+        models.Play.objects.filter(puzzle=self.puzzle, player=None)\
+            .update(missed=True, repeats=True)
+        self.clients = []
+        for name in ("One", "Two"):
+            user = User.objects.create_user(name, first_name=name)
+            models.Player.objects.create(user=user, minimumwordlength=0)
+            client = APIClient()
+            client.force_authenticate(user)
+            self.clients.append(client)
+        one, two = self.clients
+        self.submit(one, "eee", "see", "eses", "eee")
+        self.submit(two, "see")
+        self.play = models.Play.objects.get(player__user__username="One")
+        self.play.complete = True
+        self.play.save()
+
+    def submit(self, client, *words):
+        for seconds, word in enumerate(words):
+            client.post('/word/', {'puzzle': self.puzzle.pk, 'word': word,
+                                   'foundtime': '00:00:%02d.5' % seconds}, format='json')
+
+    def listwords(self, client, query=""):
+        data = client.get('/wordlist/%d/%s' % (self.puzzle.pk, query)).data
+        return data['wordlist_set'], data['cursor']
+
+    def compact(self):
+        out = io.StringIO()
+        call_command('compactplays', '--age', '0', '--pause', '0', '--batch', '1', stdout=out)
+        return out.getvalue()
+
+    def test_listwords(self):
+        one, two = self.clients
+        before = [self.listwords(client) for client in self.clients]
+        since = self.listwords(two, "?since=%d" % (before[0][1] - 2))
+
+        self.assertIn("Archived 4 records from 1 plays", self.compact())
+        self.assertEqual(models.WordList.objects.filter(play=self.play).count(), 0)
+        self.assertEqual(models.WordList.objects.count(), 1)
+        self.assertEqual([self.listwords(client) for client in self.clients], before)
+        self.assertEqual(self.listwords(two, "?since=%d" % (before[0][1] - 2)), since)
+        # Nothing left to archive.
+        self.assertIn("Archived 0 records from 0 plays", self.compact())
+
+    def test_found(self):
+        one, two = self.clients
+        self.compact()
+        # A word found before the play was archived is still a repeat.
+        self.submit(one, "see")
+        self.assertEqual(archive.wordids(self.play), set(
+            models.Word.objects.filter(word__in=["eee", "see"]).values_list('pk', flat=True)))
+        self.assertEqual(models.WordList.objects.filter(play=self.play).get().word, None)
+
+        response = one.get('/wordlist/%d/path/see/' % self.puzzle.pk)
+        self.assertEqual(len(response.data['path']), 3)
+        hint = one.get('/wordlist/%d/hint/' % self.puzzle.pk).data
+        self.assertIn(hint['length'], (3, 4))
+
+        out = io.StringIO()
+        call_command('recomputescores', '--check', stdout=out)
+        self.assertIn("1 plays checked, 0 had drifted", out.getvalue())
@@ -0,0 +1,141 @@
+"""
+An in-process cache of the words that can be found on each puzzle, for checking submitted words.
+
+Word submission is by far the most common request, and a puzzle's word list never changes once
+it's been created. So the first submission for a puzzle loads {word: word id} for it, from its
+packed solution (see bog.packed) and a query for the spellings, and after that, checking a word
+is a dictionary lookup. Each player's play record for the puzzle is remembered too, so a valid
+word costs nothing but the insert of its WordList row.
+
+Play records are only remembered for settings.BOG_VALIDWORDS_TTL seconds, and then read again.
+Completing one in this process drops the puzzle at once (see below), but a play that's changed in
+another process (made complete, or given other rules) can have words checked against the old
+record here for up to that long. That's intended: it's the same few seconds' grace a player
+gets from any other delay in getting a word to the server.
+
+The most recently used settings.BOG_VALIDWORDS_SIZE puzzles are kept. A puzzle is dropped from
+the cache when it, or any player's play of it, is saved as complete, and is loaded again if
+needed.
+"""
+import collections
+import threading
+import time
+
+from django.conf import settings
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from bog import archive, models, puzzles
+
+
+class PuzzleWords:
+    """
+    The cached words for one puzzle.
+
+    play
+        The puzzle's default play record (player=null).
+
+    words
+        {word: word id} for every word on the puzzle.
+
+    plays
+        {user id: (play record, when it was read)} for the players whose play records have been
+        looked up so far.
+
+    found
+        {play id: set of word ids} found by each play, for write-behind. See claim().
+    """
+    def __init__(self, play):
+        self.play = play
+        self.words = {spelling: word for word, spelling
+                      in puzzles.spellings(play.puzzle.solved().ids).items()}
+        self.plays = {}
+        self.found = {}
+        self._lock = threading.Lock()
+
+    def playfor(self, user):
+        """
+        Returns the user's play record for this puzzle, creating it if this is their first word.
+        It's read again if it was read more than settings.BOG_VALIDWORDS_TTL seconds ago. Raises
+        AttributeError if the user has no player record.
+        """
+        entry = self.plays.get(user.pk)
+        if entry is not None and time.monotonic() - entry[1] < settings.BOG_VALIDWORDS_TTL:
+            return entry[0]
+        with self._lock:
+            play = models.Play.objects.filter(puzzle=self.play.puzzle_id,
+                                              player__user=user).first()
+            if play is None:
+                # There is no play record for this user/puzzle combination. Create it.
+                play = models.Play(puzzle=self.play.puzzle, player=user.player)
+                play.save()
+            self.plays[user.pk] = (play, time.monotonic())
+        return play
+
+    def claim(self, play, word):
+        """
+        Record that the play has found the word (by id), and return True, unless it had found it
+        already. Only used with write-behind (see bog.writebehind), where there's nothing in the
+        database to say so yet.
+        """
+        with self._lock:
+            found = self.found.get(play.pk)
+            if found is None:
+                found = self.found[play.pk] = archive.wordids(play)
+            if word in found:
+                return False
+            found.add(word)
+            return True
+
+    def release(self, play, word):
+        """Undo claim(), for a word that couldn't be written after all."""
+        with self._lock:
+            found = self.found.get(play.pk)
+            if found is not None:
+                found.discard(word)
+
+
+_puzzles = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+def get(puzzle):
+    """
+    Returns the PuzzleWords for the puzzle with the given id, or None if there's no such
+    playable puzzle.
+    """
+    with _lock:
+        entry = _puzzles.get(puzzle)
+        if entry is not None:
+            _puzzles.move_to_end(puzzle)
+            return entry
+    play = models.Play.objects.select_related('puzzle')\
+        .filter(puzzle=puzzle, player=None, puzzle__pooled=False).first()
+    if play is None:
+        return None
+    entry = PuzzleWords(play)
+    with _lock:
+        _puzzles[puzzle] = entry
+        while len(_puzzles) > settings.BOG_VALIDWORDS_SIZE:
+            _puzzles.popitem(last=False)
+    return entry
+
+
+def release(puzzle, play, word):
+    """PuzzleWords.release() for the puzzle with the given id, if it's in the cache."""
+    with _lock:
+        entry = _puzzles.get(puzzle)
+    if entry is not None:
+        entry.release(play, word)
+
+
+def forget(puzzle):
+    """Drop the puzzle with the given id from the cache."""
+    with _lock:
+        _puzzles.pop(puzzle, None)
+
+
+@receiver(post_save, sender=models.Play)
+def _playsaved(sender, instance, **kwargs):
+    if instance.complete:
+        forget(instance.puzzle_id)
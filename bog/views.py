@@ -1,12 +1,24 @@
+import json
+import random
+
 from bog import serializers
-from . import models
+from . import archive, leaderboard, models, puzzles, writebehind
+from .broker import broker
+from .pyBogged import board
 from rest_framework import viewsets, mixins, status
 from rest_framework.permissions import IsAdminUser, IsAuthenticatedOrReadOnly, IsAuthenticated
-from rest_framework.decorators import api_view
+from rest_framework.decorators import action, api_view, renderer_classes
+from rest_framework.fields import BooleanField
+from rest_framework.renderers import BaseRenderer, JSONRenderer
 from rest_framework.response import Response
+from rest_framework.pagination import CursorPagination
 from rest_framework.reverse import reverse
+from django.conf import settings
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.db import IntegrityError
+from django.db.models import Count, Max, Prefetch
+from django.utils.http import parse_etags, quote_etag
 
 # Create your views here.
 
@@ -24,7 +36,7 @@ from django.db import IntegrityError
 #     4c1. Word exists and is long enough, add it with the duration passed from the frontend.
 #     4c2. Otherwise, it's rejected and a WordList record added, either empty or referncing the
 #     too short word.
-#   4d. Update word lists of other players.
+#   4d. Update word lists of other players. (Either polled, or pushed by wordstream.)
 #     4d1. This query looks like play.puzzle.play
 #     play->puzzle->all plays where player!=null, all words, filterby(words in player->play->words)
 #     And this result should be {'word': [playerlist],...}
@@ -33,7 +45,8 @@ from django.db import IntegrityError
 #  5. End the game. Time is up or the player hit "give up" button. (this is SOLELY client-side,
 #  which means it's gameable - if the user edits values on their end, we'll just ignore it. cheating
 #  is it's own punishment.)
-#    5a. Update score by iteration through play.words.
+#    5a. Update score by iteration through play.words. (Now kept up to date as words are found:
+#    see bog.scoring.)
 #    5b. Mark play as completed.
 #  6. Player record is updated with new handicap.
 
@@ -55,6 +68,12 @@ def api_root(request, format=None):
         r'diceset':  reverse('diceset-list', request=request, format=format),
         r'play':     reverse('play-list', request=request, format=format),
         r'words':    reverse('wordlist', request=request, format=format, args=(1,)),
+        r'wordpath': reverse('wordpath', request=request, format=format, args=(1, 'word')),
+        r'hint':     reverse('hint', request=request, format=format, args=(1,)),
+        r'solution': reverse('solution', request=request, format=format, args=(1,)),
+        r'stream':   reverse('wordstream', request=request, format=format, args=(1,)),
+        r'standings': reverse('standings', request=request, format=format, args=(1,)),
+        r'puzzlejob': reverse('puzzlejob', request=request, format=format, args=(1,)),
         r'word':     reverse('word-list', request=request, format=format),
         r'puzzle':   reverse('puzzle-list', request=request, format=format),
         r'player':   reverse('player-list', request=request, format=format),
@@ -81,6 +100,27 @@ class WordListViewSet(viewsets.GenericViewSet,
             return super().create(request, *args, **kwargs)
         except IntegrityError as x:
             return Response(x.args, status=status.HTTP_409_CONFLICT)
+        except writebehind.Unavailable as x:
+            return Response(x.args, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        Several words found on one puzzle at once: {"puzzle": id, "words": [{"word": ...,
+        "foundtime": ...}, ...]}. Returns what became of each word. See WordBatchSerializer.
+        """
+        serializer = serializers.WordBatchSerializer(data=request.data,
+                                                     context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        try:
+            results = serializer.save()
+        except IntegrityError as x:
+            # The same word was added by another request at the same time. Nothing was saved,
+            # so the whole batch can be sent again.
+            return Response(x.args, status=status.HTTP_409_CONFLICT)
+        except writebehind.Unavailable as x:
+            return Response(x.args, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response({'results': results}, status=status.HTTP_201_CREATED)
 
 
 class ListCreateDiceSetView(viewsets.ModelViewSet):
@@ -91,6 +131,21 @@ class ListCreateDiceSetView(viewsets.ModelViewSet):
                                     'update': [IsAdminUser]}
 
 
+class NewestFirst(CursorPagination):
+    """
+    Pages of open puzzles, newest first. Each page follows on from the last puzzle of the one
+    before, so it's found from the index on Puzzle, however far down the list it is.
+
+    The cursor only holds the last puzzle's created time, and how many puzzles before it on the
+    page had the same time. So puzzles created at the same instant are paged through in order of
+    id all right, but if one of them is closed or added between two pages, the next page can skip
+    or repeat one of them. Times are to the microsecond, so that's a small price for a cursor
+    that follows created, which is what the list is in order of.
+    """
+    ordering = ('-created', '-id')
+    page_size = 20
+
+
 class ListCreatePuzzleView(viewsets.ModelViewSet):
     """
     Use this to create new puzzles, and to get lists of current puzzles.
@@ -101,13 +156,47 @@ class ListCreatePuzzleView(viewsets.ModelViewSet):
     Several filtering options are available. In particular, this will usually be accessed as:
         "/puzzle/?complete=false"
 
-    Also, most recently created puzzles are listed first.
+    Also, most recently created puzzles are listed first, a page at a time. Follow "next" for
+    the next page.
+
+    Creating a puzzle usually takes one from a pool that's rolled ahead of time. When the pool is
+    empty, the answer is "202 Accepted" with a job instead, and the puzzle turns up at the job's
+    "url" once it's been rolled. Staff can add "?sync=true" to wait for it instead.
+
+    To keep timed games fair, "minwords", "maxwords" and "longest" (the length of a word the
+    board must have) can be given as well, and the dice are rolled until a board fits.
     """
     queryset = models.Puzzle.objects\
-        .filter(options__complete=False, options__player__isnull=True)\
-        .order_by('-options__date')
+        .filter(pooled=False, is_open=True)\
+        .select_related('createdby')\
+        .prefetch_related(Prefetch('options', queryset=models.Play.objects.filter(player=None)))\
+        .order_by('-created', '-id')
     serializer_class = serializers.PuzzleSerializer
+    pagination_class = NewestFirst
     permission_classes = (IsAuthenticatedOrReadOnly, )
+
+    def create(self, request, *args, **kwargs):
+        sync = request.query_params.get('sync', 'false')
+        if sync not in BooleanField.TRUE_VALUES | BooleanField.FALSE_VALUES:
+            return Response({"sync": "Must be true or false"}, status=status.HTTP_400_BAD_REQUEST)
+        if sync in BooleanField.TRUE_VALUES:
+            # Rolling in the request ties up a web worker for as long as it takes.
+            if not request.user.is_staff:
+                return Response({"Only staff can wait for a puzzle to be rolled"},
+                                status=status.HTTP_403_FORBIDDEN)
+            return super().create(request, *args, **kwargs)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        options = serializer.validated_data.get('options') or [{}]
+        result = puzzles.start(serializer.validated_data['diceset'], request.user, options[0],
+                               serializer.constraints())
+        if isinstance(result, models.Puzzle):
+            serializer.instance = result
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        job = serializers.PuzzleJobSerializer(result, context=self.get_serializer_context())
+        return Response(job.data, status=status.HTTP_202_ACCEPTED,
+                        headers={'Location': job.data['url']})
+
     # TODO: Create puzzle special effects
 
 
@@ -153,18 +242,238 @@ def listwords(request, pk):
     """
     Use this to get a list of words the user has found on
     this puzzle. 'GET' is the only method allowed.
+
+    The response includes a "cursor". Pass it back as ?since=<cursor> to get only what's been
+    found since (see PlayWordListSerializer). The ETag changes whenever a word is found on the
+    puzzle, so If-None-Match gets a 304 if nothing has.
     """
     # request.auth()
     if(not request.user.is_authenticated):
         return Response({"Must be authenticated to list words"}, status=status.HTTP_403_FORBIDDEN)
 
+    since = request.query_params.get('since')
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            return Response({"since": "Must be a cursor from an earlier response"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+    play = get_object_or_404(
+        models.Play,
+        puzzle__pk=pk,
+        player__user=request.user
+    )
+
+    # WordList ids only ever go up, so the newest one and how many there are changes whenever
+    # anything does. Archiving plays (see bog.archive) changes them too, which does no harm.
+    latest = models.WordList.objects.filter(play__puzzle=pk)\
+        .aggregate(cursor=Max('pk'), count=Count('pk'))
+    etag = quote_etag("%d-%d-%d" % (play.pk, latest['cursor'] or 0, latest['count']))
+    if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+    serializer = serializers.PlayWordListSerializer(play, context={'since': since})
+    data = serializer.data
+    # The newest records may have been archived since the last cursor was given out, but
+    # there's nothing newer than it either way.
+    data['cursor'] = max(latest['cursor'] or 0, since or 0)
+    return Response(data, headers={'ETag': etag})
+
+
+def _path(puzzle, solution, word):
+    """The cells spelling a Word on the puzzle, as a list. Puzzles solved before paths were
+    stored are searched instead."""
+    path = solution.path(word.pk)
+    if path is None:
+        path = board(puzzle.width, puzzle.height, puzzle.layout).find(word.word)
+    return list(path)
+
+
+@api_view(["GET"])
+def wordpath(request, pk, word):
+    """
+    Where is this word on the puzzle? Returns the cells spelling it, numbered in the same order as
+    the puzzle's layout. Only words the player has already found can be asked about, until
+    they've completed the puzzle.
+    """
+    if not request.user.is_authenticated:
+        return Response({"Must be authenticated to find words"},
+                        status=status.HTTP_403_FORBIDDEN)
+
+    play = get_object_or_404(
+        models.Play,
+        puzzle__pk=pk,
+        player__user=request.user
+    )
+    word = models.Word.objects.filter(word=word).first()
+    if not play.complete and (word is None or word.pk not in archive.wordids(play)):
+        return Response({"Word not found yet"}, status=status.HTTP_403_FORBIDDEN)
+    if word is None:
+        raise Http404
+    puzzle = models.Puzzle.objects.get(pk=pk)
+    solution = puzzle.solved()
+    if word.pk not in solution:
+        return Response({"Not on this puzzle"}, status=status.HTTP_404_NOT_FOUND)
+    return Response({'word': word.word, 'path': _path(puzzle, solution, word)})
+
+
+@api_view(["GET"])
+def hint(request, pk):
+    """
+    A hint for a word the player hasn't found yet: the cell it starts on and its length.
+    """
+    if not request.user.is_authenticated:
+        return Response({"Must be authenticated to get hints"},
+                        status=status.HTTP_403_FORBIDDEN)
+
+    play = get_object_or_404(
+        models.Play.objects.select_related('puzzle'),
+        puzzle__pk=pk,
+        player__user=request.user
+    )
+    puzzle = play.puzzle
+    solution = puzzle.solved()
+    found = archive.wordids(play)
+    left = [word for word in solution if word not in found]
+    if not left:
+        return Response({"No words left to find"}, status=status.HTTP_404_NOT_FOUND)
+
+    word = models.Word.objects.get(pk=random.choice(left))
+    return Response({'start': _path(puzzle, solution, word)[0], 'length': len(word.word)})
+
+
+@api_view(["GET"])
+def solution(request, pk):
+    """
+    Every word on the puzzle, and where it is, once the player has completed it.
+    """
+    if not request.user.is_authenticated:
+        return Response({"Must be authenticated to see the solution"},
+                        status=status.HTTP_403_FORBIDDEN)
+
+    play = get_object_or_404(
+        models.Play.objects.select_related('puzzle'),
+        puzzle__pk=pk,
+        player__user=request.user
+    )
+    if not play.complete:
+        return Response({"Puzzle not complete yet"}, status=status.HTTP_403_FORBIDDEN)
+
+    puzzle = play.puzzle
+    solution = puzzle.solved()
+    words = models.Word.objects.in_bulk(list(solution))
+    return Response({'words': [{'word': words[word].word,
+                                'path': _path(puzzle, solution, words[word])}
+                               for word in sorted(solution, key=lambda word: words[word].word)]})
+
+
+@api_view(["GET"])
+def standings(request, pk):
+    """
+    The puzzle's leaderboard: the top players (?top=, 10 by default) and where the logged in
+    player is on it. See bog.leaderboard.
+    """
+    if not request.user.is_authenticated:
+        return Response({"Must be authenticated to see the leaderboard"},
+                        status=status.HTTP_403_FORBIDDEN)
+    try:
+        top = min(int(request.query_params.get('top', 10)), 100)
+    except ValueError:
+        return Response({"top": "Must be a number"}, status=status.HTTP_400_BAD_REQUEST)
+
+    board = leaderboard.get(int(pk))
+    play = models.Play.objects.filter(puzzle__pk=pk, player__user=request.user)\
+        .values_list('pk', flat=True).first()
+    return Response({
+        'players': len(board),
+        'top': [{'rank': rank, 'player': name, 'score': score}
+                for rank, name, score in board.top(top)],
+        'rank': board.rank(play),
+        'score': board.scores.get(play),
+    })
+
+
+@api_view(["GET"])
+def puzzlejob(request, pk):
+    """
+    How a puzzle asked for with POST /puzzle/ is coming along. Only whoever asked for it can see
+    it.
+    """
+    if not request.user.is_authenticated:
+        return Response({"Must be authenticated to see puzzle jobs"},
+                        status=status.HTTP_403_FORBIDDEN)
+    job = get_object_or_404(models.PuzzleJob.objects.select_related('puzzle__createdby'), pk=pk)
+    if job.createdby_id != request.user.pk and not request.user.is_staff:
+        return Response({"Not your puzzle job"}, status=status.HTTP_403_FORBIDDEN)
+    return Response(serializers.PuzzleJobSerializer(job, context={'request': request}).data)
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Lets clients ask for text/event-stream. Only errors are rendered, as JSON."""
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data).encode()
+
+
+def _events(subscription, play, found):
+    """
+    Server-sent events for the player, from their subscription to the puzzle: "word" for words
+    they find themselves, and "player" for words they've found that somebody else finds.
+    """
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            event = subscription.get(settings.BOG_STREAM_KEEPALIVE)
+            if event is None:
+                # A comment, so that proxies don't give up on the connection.
+                yield ": keepalive\n\n"
+                continue
+            if event['play'] == play:
+                found.add(event['word'])
+                name = 'word'
+            elif event['word'] in found:
+                name = 'player'
+            else:
+                # Nobody gets to hear about words they haven't found yet.
+                continue
+            yield "event: %s\nid: %d\ndata: %s\n\n" % (name, event['cursor'], json.dumps(event))
+    finally:
+        subscription.close()
+
+
+@api_view(["GET"])
+@renderer_classes([JSONRenderer, EventStreamRenderer])
+def wordstream(request, pk):
+    """
+    Words found on this puzzle as they're found, as server-sent events, instead of polling
+    /wordlist/<pk>/. Each event's id is a cursor for /wordlist/<pk>/?since=, for catching up
+    after reconnecting.
+
+    Every open stream takes up a server thread, so run a server with plenty of them.
+    """
+    if not request.user.is_authenticated:
+        return Response({"Must be authenticated to follow words"},
+                        status=status.HTTP_403_FORBIDDEN)
+
     play = get_object_or_404(
         models.Play,
         puzzle__pk=pk,
         player__user=request.user
     )
-    serializer = serializers.PlayWordListSerializer(play)
-    return Response(serializer.data)
+    # Subscribe first, so that nothing found while we're looking up the player's words is lost.
+    subscription = broker().subscribe(play.puzzle_id)
+    found = set(puzzles.spellings(archive.wordids(play)).values())
+
+    response = StreamingHttpResponse(_events(subscription, play.pk, found),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from holding on to events until it has a buffer full.
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 class PlayerModelView(viewsets.ModelViewSet):
@@ -0,0 +1,238 @@
+"""
+Write-behind for found words, for databases (SQLite) that only let one connection write at a time.
+
+When everybody types their last words at the end of a game, each submission wants the database
+write lock for its own little transaction, and some of them give up waiting. With
+settings.BOG_WRITEBEHIND set, a submission is checked against the puzzle's words in memory (see
+bog.validwords) and answered from there, and its WordList record is queued. A writer thread
+stores everything queued every settings.BOG_WRITEBEHIND_INTERVAL seconds, in one transaction.
+
+With settings.BOG_WRITEBEHIND_DURABLE, each submission still waits for the transaction with its
+word in it to commit before it's answered. That's slower, but words can't be lost, and it still
+takes the write lock once for many words. Without it, words that have been answered but not yet
+written are lost if the process dies. They're written on the way out of a normal shutdown.
+
+A durable submission whose word isn't written within settings.BOG_WRITEBEHIND_TIMEOUT seconds, or
+can't be written at all, is answered "503 Service Unavailable". A word that turns out to have been
+found already, by another process, is written as a repeat if the play counts them, as it would
+have been had it been written straight away.
+"""
+import atexit
+import collections
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, connection, transaction
+
+from bog import broker, leaderboard, models, scoring, validwords
+
+logger = logging.getLogger(__name__)
+
+REPEATED = "Not Unique. Word alread found."
+
+
+class Unavailable(Exception):
+    """A durable submission's word hasn't been written, and may never be. Try again."""
+
+
+class Found:
+    """
+    A found word waiting to be written. Once it's been dealt with, written is set (if there's
+    anybody waiting for it), with error set first if it wasn't written as submitted.
+    """
+    __slots__ = ('wordlist', 'spelling', 'change', 'user', 'written', 'error')
+
+    def __init__(self, wordlist, spelling, change, user, durable):
+        self.wordlist = wordlist
+        self.spelling = spelling
+        self.change = change
+        self.user = user
+        self.written = threading.Event() if durable else None
+        self.error = None
+
+    def done(self, error=None):
+        self.error = error or self.error
+        if self.written is not None:
+            self.written.set()
+
+
+class Writer:
+    """
+    Queues found words, and writes them in batches. Call start() to write them from a thread of
+    its own every interval seconds, or write() to write whatever's queued now.
+    """
+    def __init__(self, interval=0.005, batch=500):
+        self.interval = interval
+        self.batch = batch
+        self.queue = queue.Queue()
+        self.thread = None
+        self.stopping = threading.Event()
+
+    def submit(self, wordlist, spelling, change, user, durable=False):
+        """
+        Queue a new WordList record (with no word, for a penalty), and what it adds to the score.
+        If durable, wait until it's been written: raises IntegrityError if it was a repeat after
+        all, and Unavailable if it couldn't be written, or hasn't been in time.
+        """
+        found, = self.submitall([(wordlist, spelling, change)], user, durable)
+        if isinstance(found.error, IntegrityError):
+            raise found.error
+
+    def submitall(self, records, user, durable=False):
+        """
+        submit() for a list of (wordlist, spelling, change) found by the same user. Returns their
+        Founds. If durable, waits until they've all been written, and raises Unavailable as
+        submit() does, but leaves the caller to look for repeats in their errors.
+        """
+        founds = [Found(wordlist, spelling, change, user, durable)
+                  for wordlist, spelling, change in records]
+        for found in founds:
+            self.queue.put(found)
+        if durable:
+            deadline = time.monotonic() + settings.BOG_WRITEBEHIND_TIMEOUT
+            for found in founds:
+                if not found.written.wait(max(deadline - time.monotonic(), 0)):
+                    raise Unavailable("Word not saved yet. Try again.")
+                if found.error is not None and not isinstance(found.error, IntegrityError):
+                    raise Unavailable("Word not saved. Try again.") from found.error
+        return founds
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="writebehind", daemon=True)
+        self.thread.start()
+        atexit.register(self.stop)
+
+    def run(self):
+        try:
+            while not self.stopping.wait(self.interval):
+                try:
+                    self.write()
+                except Exception:
+                    logger.exception("Writing found words")
+        finally:
+            # This thread had a database connection of its own.
+            connection.close()
+
+    def stop(self):
+        """Stop the thread, once everything queued has been written."""
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.write()
+
+    def write(self):
+        """Write everything queued so far, a batch at a time."""
+        while True:
+            batch = []
+            try:
+                while len(batch) < self.batch:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            if not batch:
+                return
+            try:
+                written, changes = self.flush(batch)
+            except OperationalError:
+                # The database is still locked, even after the busy timeout. Try again next time.
+                for found in batch:
+                    self.queue.put(found)
+                raise
+            except Exception as error:
+                # Nothing was written. Let them be found again, and say so to anybody waiting.
+                for found in batch:
+                    if found.wordlist.word_id is not None:
+                        validwords.release(found.wordlist.play.puzzle_id, found.wordlist.play,
+                                           found.wordlist.word_id)
+                    found.done(error)
+                raise
+            for found in batch:
+                found.done()
+            self.publish(written, changes)
+
+    def flush(self, batch):
+        """
+        Write the batch, and add it to the scores, in one transaction. Returns the ones written
+        as submitted, and the changes in the scores (see score()).
+        """
+        try:
+            with transaction.atomic():
+                models.WordList.objects.bulk_create([found.wordlist for found in batch])
+                return batch, self.score(batch)
+        except IntegrityError:
+            pass
+        # Somebody found one of the same words in another process. Write them one at a time,
+        # with the ones that turn out to be repeats after all as repeats, if the play counts them.
+        written = []
+        repeats = []
+        with transaction.atomic():
+            for found in batch:
+                try:
+                    with transaction.atomic():
+                        found.wordlist.save()
+                    written.append(found)
+                    continue
+                except IntegrityError:
+                    found.error = IntegrityError(REPEATED)
+                play = found.wordlist.play
+                if play.repeats:
+                    found.wordlist.word_id = None
+                    found.change = scoring.points(None, play.minimumwordlength)
+                    found.wordlist.save()
+                    repeats.append(found)
+            changes = self.score(written + repeats)
+        return written, changes
+
+    @staticmethod
+    def publish(written, changes):
+        """Pass the new scores to the leaderboard, and the new words to the broker."""
+        for (puzzle, play), change in changes.items():
+            leaderboard.scored(puzzle, play, change)
+
+        # Let everybody else playing these puzzles know. Not every database says what ids
+        # bulk_create gave the new rows, so look them up.
+        words = {(found.wordlist.play_id, found.wordlist.word_id): found for found in written
+                 if found.wordlist.word_id is not None}
+        if words:
+            for pk, play, word in models.WordList.objects\
+                    .filter(play__in={play for play, word in words},
+                            word__in={word for play, word in words})\
+                    .values_list('pk', 'play', 'word'):
+                found = words.get((play, word))
+                if found is not None:
+                    found.wordlist.pk = pk
+                    broker.found(found.wordlist, found.spelling, found.user)
+
+    @staticmethod
+    def score(written):
+        """Add the written words' points to their plays' scores. Returns the changes in the scores,
+        by (puzzle, play)."""
+        points = collections.Counter()
+        plays = {}
+        for found in written:
+            points[found.wordlist.play_id] += found.change
+            plays[found.wordlist.play_id] = found.wordlist.play
+        changes = {}
+        for play, change in points.items():
+            change = scoring.add(plays[play], change)
+            if change:
+                changes[plays[play].puzzle_id, play] = change
+        return changes
+
+
+_writer = None
+_writerlock = threading.Lock()
+
+
+def writer():
+    """The process-wide writer, started the first time it's needed."""
+    global _writer
+    if _writer is None:
+        with _writerlock:
+            if _writer is None:
+                _writer = Writer(settings.BOG_WRITEBEHIND_INTERVAL)
+                _writer.start()
+    return _writer
@@ -48,7 +48,7 @@ INSTALLED_APPS = [
     'allauth',
     'allauth.account',
     'corsheaders',
-    'bog',
+    'bog.apps.BogConfig',
 ]
 
 # rest_auth registration stuff
@@ -101,10 +101,73 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Seconds to wait for another connection's write to finish, rather than failing with
+        # "database is locked". bog.apps also puts SQLite databases in WAL mode, so that reading
+        # doesn't have to wait for writing.
+        'OPTIONS': {'timeout': 20},
     }
 }
 
 
+# The compiled word index, written by "manage.py compilewords". Every worker maps this one file
+# read only. If it doesn't exist, each process reads the dictionary itself on first use.
+BOG_WORDINDEX = os.path.join(BASE_DIR, 'wordindex.bin')
+
+# Pre-rolled puzzles kept ready for each dice set, so that creating a puzzle doesn't have to wait
+# for the board to be solved. The pool is refilled to BOG_POOL_SIZE in the background when it
+# drops below BOG_POOL_LOW_WATER. Set BOG_POOL_SIZE to 0 to roll every puzzle on demand.
+BOG_POOL_SIZE = 10
+BOG_POOL_LOW_WATER = 3
+
+# Worker processes that roll puzzles asked for when the pool is empty, while the request that asked
+# is answered with a job to poll (see bog.puzzles.start). With 0, they're rolled in the request.
+# Each web server process starts its own pool, the first time a job needs it, so this many spawned
+# Python processes per web process, each with its own database connection and word index: with
+# 4 gunicorn workers and 2 here, that's 8 more processes. Set it where that's affordable.
+BOG_PUZZLE_WORKERS = 0
+
+# When a puzzle is asked for with a minimum or maximum number of words, or a long word it has to
+# have, the dice are rolled (BOG_GENERATE_BATCH boards at a time) until a board fits, for up to
+# BOG_GENERATE_ATTEMPTS boards or BOG_GENERATE_TIMEOUT seconds.
+BOG_GENERATE_ATTEMPTS = 1000
+BOG_GENERATE_TIMEOUT = 5
+BOG_GENERATE_BATCH = 32
+
+# How many solved boards to remember in each process, keyed by the board's canonical form under
+# rotation and reflection. If BOG_SOLUTIONCACHE_FILE is set, every solution is kept in an sqlite
+# database there as well, shared between processes and restarts. A size of 0 turns it off.
+BOG_SOLUTIONCACHE_SIZE = 1000
+BOG_SOLUTIONCACHE_FILE = None
+
+# How many puzzles' word lists to keep in memory for checking submitted words, and how many
+# seconds before each player's play record is read again, to pick up changes made by other
+# processes. See bog.validwords.
+BOG_VALIDWORDS_SIZE = 200
+BOG_VALIDWORDS_TTL = 5
+
+# Where found words are published for /wordlist/<pk>/stream/ (see bog.broker), and how often, in
+# seconds, a quiet stream sends something anyway to keep the connection open. LocalBroker only
+# reaches streams in the same process, so a server running several should use
+# 'bog.broker.DatabaseBroker', which looks for new words every BOG_BROKER_POLL seconds.
+BOG_BROKER = 'bog.broker.LocalBroker'
+BOG_BROKER_POLL = 1
+BOG_STREAM_KEEPALIVE = 15
+
+# How many puzzles' leaderboards to keep in memory, and how many seconds before each is read
+# again to pick up scores changed by other processes. See bog.leaderboard.
+BOG_LEADERBOARD_SIZE = 200
+BOG_LEADERBOARD_TTL = 5
+
+# Answer word submissions from memory, and write them to the database in batches every
+# BOG_WRITEBEHIND_INTERVAL seconds. With BOG_WRITEBEHIND_DURABLE, submissions still wait for their
+# batch to be written, so that nothing answered is ever lost, for up to BOG_WRITEBEHIND_TIMEOUT
+# seconds before giving up with "503 Service Unavailable". See bog.writebehind.
+BOG_WRITEBEHIND = False
+BOG_WRITEBEHIND_INTERVAL = 0.005
+BOG_WRITEBEHIND_DURABLE = True
+BOG_WRITEBEHIND_TIMEOUT = 10
+
+
 # Password validation
 # https://docs.djangoproject.com/en/1.11/ref/settings/#auth-password-validators
 
@@ -15,6 +15,12 @@ router.register(r'word', views.WordListViewSet, base_name='word')
 urlpatterns = [
     url(r'^', include(router.urls)),
     url(r'^wordlist/(\d+)/$', views.listwords, name="wordlist"),
+    url(r'^wordlist/(\d+)/path/(\w+)/$', views.wordpath, name="wordpath"),
+    url(r'^wordlist/(\d+)/hint/$', views.hint, name="hint"),
+    url(r'^wordlist/(\d+)/solution/$', views.solution, name="solution"),
+    url(r'^wordlist/(\d+)/stream/$', views.wordstream, name="wordstream"),
+    url(r'^puzzle/(\d+)/standings/$', views.standings, name="standings"),
+    url(r'^puzzlejob/(\d+)/$', views.puzzlejob, name="puzzlejob"),
     url(r'admin/', admin.site.urls, name='admin'),
     url(r'^$', views.api_root, name='api_root'),
     url(r'^auth/', include('rest_auth.urls')),
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "swampbackend.settings")
 
 application = get_wsgi_application()
+
+# Map the word index now, so that servers which load the application before forking workers
+# (gunicorn --preload, uwsgi without lazy-apps) share a single copy of it between them all.
+from bog.pyBogged import wordindex  # noqa: E402
+wordindex()